@@ -3,31 +3,59 @@
 # Licença: MIT
 
 import argparse
+import contextlib
 import json
 import os
 import queue
+import random
+import signal
+import struct
+import sys
 import threading
 import time
-from datetime import datetime, timezone
+from collections import OrderedDict, deque, namedtuple
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing import shared_memory
+from types import SimpleNamespace
 
-import psutil
-import uiautomation as uia
-from pynput import mouse, keyboard
 from tzlocal import get_localzone
 
+# Dependências de captura real (Windows). O backend "replay" funciona sem elas.
+try:
+    import psutil
+except ImportError:
+    psutil = None
+try:
+    import uiautomation as uia
+except Exception:
+    uia = None
+try:
+    from pynput import mouse, keyboard
+except Exception:
+    mouse = keyboard = None
+
 try:
     from aw_client import ActivityWatchClient
+    from aw_core.models import Event
 except Exception as e:
     raise SystemExit("aw-client não encontrado. pip install aw-client")
 
 LOCAL_TZ = get_localzone()
 
+# Mesmo diretório gravável usado pelo workbench
+DATA_DIR = os.path.join(os.environ.get("LOCALAPPDATA", os.path.expanduser("~")), "SENAI_Process_Mining_Suite")
+
 # -------- Utilidades --------
 
 def now_iso():
     return datetime.now(timezone.utc).astimezone(LOCAL_TZ).isoformat()
 
 
+def _utc_iso(wall):
+    return datetime.fromtimestamp(wall, timezone.utc).isoformat()
+
+
 def bbox_to_dict(rect):
     # rect: uia.Rect(left, top, right, bottom)
     try:
@@ -56,115 +84,1783 @@ def control_path(ctrl, depth=4):
     return list(reversed(parts))
 
 
+class ProcNameCache:
+    """Memoiza nome de processo por (pid, create_time).
+
+    Entradas são revalidadas preguiçosamente: passado ``revalidate``
+    segundos, o create_time do PID é relido e, se mudou (PID reutilizado),
+    o nome é lido de novo. O tamanho é limitado (LRU).
+    """
+
+    def __init__(self, maxsize=512, revalidate=10.0):
+        self.maxsize = maxsize
+        self.revalidate = revalidate
+        self._items = OrderedDict()  # pid -> (create_time, name, checked_at)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, pid):
+        if pid is None:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            item = self._items.get(pid)
+            if item is not None and now - item[2] < self.revalidate:
+                self._items.move_to_end(pid)
+                self.hits += 1
+                return item[1]
+        try:
+            proc = psutil.Process(pid)
+            create_time = proc.create_time()
+            if item is not None and item[0] == create_time:
+                name = item[1]
+                with self._lock:
+                    self.hits += 1
+            else:
+                name = proc.name()
+                with self._lock:
+                    self.misses += 1
+        except Exception:
+            with self._lock:
+                self._items.pop(pid, None)
+            return None
+        with self._lock:
+            self._items[pid] = (create_time, name, now)
+            self._items.move_to_end(pid)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+        return name
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._items)}
+
+
+PROC_NAMES = ProcNameCache()
+
+
 def proc_name(pid):
+    return PROC_NAMES.get(pid)
+
+
+# -------- Registro de evento --------
+ETYPES = ("mouse_click", "key_press", "typing", "afk_start", "afk_end")
+ETYPE_CODES = {name: code for code, name in enumerate(ETYPES)}
+# campo de data que recebe o ``detail`` de cada tipo de evento
+DETAIL_FIELDS = {ETYPE_CODES["mouse_click"]: "button", ETYPE_CODES["key_press"]: "key_category"}
+
+
+class UIAEvent:
+    """Evento interno compacto que circula pela fila do publisher.
+
+    ``ctx`` é o dict de contexto compartilhado do cache (strings internadas,
+    não é copiado por evento), ``etype`` um inteiro pequeno e ``detail`` o
+    botão/categoria de tecla. A conversão para o formato do aw-server
+    (timestamp ISO + dict ``data``) só acontece no envio, via ``to_wire()``.
+    """
+
+    __slots__ = ("wall", "duration", "etype", "detail", "ctx", "extra")
+
+    def __init__(self, wall, etype, ctx=None, detail=None, extra=None, duration=0.0):
+        self.wall = wall
+        self.duration = duration
+        self.etype = ETYPE_CODES[etype]
+        self.detail = detail
+        self.ctx = ctx
+        self.extra = extra
+
+    def to_wire(self):
+        data = {"etype": ETYPES[self.etype]}
+        if self.detail is not None:
+            data[DETAIL_FIELDS[self.etype]] = self.detail
+        if self.extra:
+            data.update(self.extra)
+        if self.ctx:
+            data.update(self.ctx)
+        return {"timestamp": _utc_iso(self.wall), "duration": self.duration, "data": data}
+
+
+def wire(event):
+    """Formato do aw-server para um UIAEvent ou um dict já serializado."""
+    return event.to_wire() if isinstance(event, UIAEvent) else event
+
+
+def intern_context(ctx):
+    """Interna as strings do contexto (app, título, tipo de controle, ...)."""
+    return {k: sys.intern(v) if type(v) is str else v for k, v in ctx.items()}
+
+
+# -------- Instrumentação --------
+class LatencyHistogram:
+    """Histograma log-linear no estilo HDR, em microssegundos.
+
+    Cada potência de 2 é dividida em 32 sub-buckets (erro relativo ~3%).
+    ``record()`` é O(1) e não aloca; sob concorrência uma contagem pode
+    raramente se perder, o que é aceitável para diagnóstico.
+    """
+
+    SUB = 32
+    SUB_BITS = 5
+
+    def __init__(self, max_us=600_000_000):
+        self.max_us = max_us
+        self.counts = [0] * (self._index(max_us) + 1)
+        self.max_seen = 0
+
+    def _index(self, us):
+        if us < self.SUB:
+            return us
+        shift = us.bit_length() - self.SUB_BITS - 1
+        return self.SUB * (shift + 1) + (us >> shift) - self.SUB
+
+    def _value(self, idx):
+        if idx < self.SUB:
+            return idx
+        shift = idx // self.SUB - 1
+        return ((self.SUB + idx % self.SUB) << shift) + (1 << shift) // 2
+
+    def record(self, seconds):
+        us = min(self.max_us, max(0, int(seconds * 1_000_000)))
+        self.counts[self._index(us)] += 1
+        if us > self.max_seen:
+            self.max_seen = us
+
+    def summary(self, since=None):
+        """p50/p95/p99 (ms) das amostras; ``since`` é uma cópia anterior de
+        ``counts`` para resumir só o intervalo desde ela."""
+        counts = self.counts if since is None else [a - b for a, b in zip(self.counts, since)]
+        total = sum(counts)
+        out = {"n": total}
+        targets = [(q, q / 100.0 * total) for q in (50, 95, 99)]
+        acc = 0
+        ti = 0
+        for idx, c in enumerate(counts):
+            if not c:
+                continue
+            acc += c
+            while ti < len(targets) and acc >= targets[ti][1]:
+                out[f"p{targets[ti][0]}"] = round(self._value(idx) / 1000.0, 3)
+                ti += 1
+            if ti == len(targets):
+                break
+        for q, _ in targets[ti:]:
+            out[f"p{q}"] = None
+        out["max"] = round(self.max_seen / 1000.0, 3)
+        return out
+
+
+class WatcherStats:
+    """Timers por estágio do pipeline e contadores do watcher."""
+
+    STAGES = ("control_from_point", "focused_control", "read_context", "control_path",
+              "publish", "hook_to_publish")
+
+    def __init__(self):
+        self.hist = {stage: LatencyHistogram() for stage in self.STAGES}
+        self.filtered = 0
+
+    def record(self, stage, seconds):
+        self.hist[stage].record(seconds)
+
+    def snapshot(self):
+        return {stage: list(h.counts) for stage, h in self.hist.items()}
+
+    def summary(self, since=None):
+        return {stage: h.summary(None if since is None else since[stage]) for stage, h in self.hist.items()}
+
+
+STATS = WatcherStats()
+
+
+class StatsReporter:
+    """Emite periodicamente um evento compacto com as estatísticas do watcher.
+
+    ``emit(event)`` recebe o evento (ex.: publish de um AWPublisher do bucket
+    de stats ou append em arquivo). ``collect()`` devolve os contadores
+    correntes a incluir no evento.
+    """
+
+    def __init__(self, emit, collect, interval=60.0, stats=None):
+        self.emit = emit
+        self.collect = collect
+        self.interval = interval
+        self.stats = STATS if stats is None else stats
+        self._stop = threading.Event()
+        self._last = self.stats.snapshot()
+        self._last_wall = time.time()
+        self.thread = threading.Thread(target=self._run, daemon=True, name="uia-stats")
+
+    def report(self):
+        now = time.time()
+        data = {
+            "etype": "watcher_stats",
+            "interval_s": round(now - self._last_wall, 1),
+            "stages_ms": self.stats.summary(self._last),
+            **self.collect(),
+        }
+        self._last = self.stats.snapshot()
+        self._last_wall = now
+        try:
+            self.emit({"timestamp": _utc_iso(now), "duration": 0, "data": data})
+        except Exception:
+            pass
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.report()
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self.report()
+
+
+# -------- Cache de contexto --------
+class ContextCache:
+    """LRU limitado de contextos resolvidos, com TTL.
+
+    A chave é o RuntimeId UIA do controle (ou hwnd + identidade do controle
+    quando o RuntimeId não está disponível). Os dicts guardados são
+    compartilhados: quem consome deve copiá-los antes de alterar.
+    """
+
+    def __init__(self, maxsize=256, ttl=2.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._items = OrderedDict()  # key -> (expires_at, ctx)
+        self._lock = threading.Lock()
+        self._last_focus = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        if key is None or self.maxsize <= 0:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            item = self._items.get(key)
+            if item is None or item[0] < now:
+                if item is not None:
+                    del self._items[key]
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def put(self, key, ctx):
+        if key is None or self.maxsize <= 0:
+            return
+        with self._lock:
+            self._items[key] = (time.monotonic() + self.ttl, ctx)
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key=None):
+        """Remove uma chave (ou tudo, se key=None)."""
+        with self._lock:
+            if key is None:
+                self._items.clear()
+            else:
+                self._items.pop(key, None)
+
+    def note_focus(self, key):
+        """Ao mudar o foco, descarta o contexto do controle que recebeu foco
+        para que a primeira leitura após a troca seja sempre fresca."""
+        with self._lock:
+            if key == self._last_focus:
+                return
+            self._last_focus = key
+            self._items.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "size": len(self._items),
+            }
+
+
+CONTEXT_CACHE = ContextCache()
+
+
+def control_key(ctrl):
+    """Identidade estável do controle para o cache (RuntimeId ou hwnd+ids)."""
     try:
-        return psutil.Process(pid).name()
+        rid = ctrl.GetRuntimeId()
+        if rid:
+            return tuple(rid)
+    except Exception:
+        pass
+    try:
+        return (ctrl.NativeWindowHandle, ctrl.ProcessId, ctrl.ControlType, ctrl.AutomationId, ctrl.Name)
     except Exception:
         return None
 
 
 # -------- Captura de contexto --------
-def context_from_point(x, y):
+# Perfis de captura: quais propriedades UIA são lidas e publicadas.
+# path: None (nunca), "changed" (só no evento em que o controle muda) ou
+# "always" (todo evento, reaproveitando o cálculo enquanto o controle não muda).
+CAPTURE_PROFILES = {
+    "minimal": {
+        "fields": ("app", "pid", "window_title", "control_type"),
+        "bbox": False,
+        "path": None,
+    },
+    "standard": {
+        "fields": ("app", "pid", "window_title", "control_type", "control_name", "automation_id"),
+        "bbox": False,
+        "path": "changed",
+    },
+    "full": {
+        "fields": ("app", "pid", "window_title", "control_type", "control_name", "automation_id"),
+        "bbox": True,
+        "path": "always",
+    },
+}
+
+PROFILE = CAPTURE_PROFILES["standard"]
+
+
+def control_context(ctrl, profile=None):
+    """Lê os metadados de um controle UIA, só os que o perfil pede.
+
+    O caminho de ancestrais não entra aqui; ver ``_cached_context``.
+    """
+    profile = PROFILE if profile is None else profile
+    fields = profile["fields"]
+    pid = ctrl.ProcessId
+    data = {"app": proc_name(pid), "pid": pid}
+    if "window_title" in fields:
+        top = ctrl.GetTopWindowControl() or ctrl
+        data["window_title"] = (top.Name or "").strip()
+    if "control_type" in fields:
+        data["control_type"] = ctrl.ControlTypeName
+    if "control_name" in fields:
+        data["control_name"] = (ctrl.Name or "").strip()
+    if "automation_id" in fields:
+        data["automation_id"] = (ctrl.AutomationId or "").strip()
+    if profile["bbox"]:
+        data["bbox"] = bbox_to_dict(ctrl.BoundingRectangle)
+    return data
+
+
+def _timed_path(provider, ctrl):
+    t0 = time.perf_counter()
+    path = provider.control_path(ctrl)
+    STATS.record("control_path", time.perf_counter() - t0)
+    return path
+
+
+class PathTracker:
+    """Lembra o controle do evento anterior e o caminho calculado para ele."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._key = None
+        self._path = None
+
+    def path_for(self, key, compute, mode):
+        """Retorna o caminho a publicar (ou None) segundo o modo do perfil."""
+        with self._lock:
+            if key is not None and key == self._key:
+                return self._path if mode == "always" else None
+        path = compute()
+        with self._lock:
+            self._key, self._path = key, path
+        return path
+
+
+PATHS = PathTracker()
+
+
+class UIAContextProvider:
+    """Provider real: consulta a árvore UI Automation do Windows."""
+
+    name = "uia"
+
+    def control_from_point(self, x, y):
+        return uia.ControlFromPoint((int(x), int(y)))
+
+    def focused_control(self):
+        return uia.GetFocusedControl()
+
+    def control_key(self, ctrl):
+        return control_key(ctrl)
+
+    def read_context(self, ctrl, profile=None):
+        return control_context(ctrl, profile)
+
+    def control_path(self, ctrl):
+        return control_path(ctrl)
+
+    def thread_scope(self):
+        # UIA é COM: cada thread precisa inicializar o próprio apartment
+        return uia.UIAutomationInitializerInThread()
+
+
+SyntheticControl = namedtuple("SyntheticControl", ["key", "ctx"])
+
+
+class ReplayContextProvider:
+    """Provider sintético para replay/carga, sem UIA.
+
+    Controles vêm de uma grade virtual da tela (``apps`` x ``controls``) ou
+    são registrados pelo ReplayInputSource a partir de uma gravação. O foco
+    acompanha o último controle clicado. ``uia_delay`` simula o custo de uma
+    leitura completa de contexto.
+    """
+
+    name = "replay"
+
+    def __init__(self, apps=5, controls=20, uia_delay=0.0):
+        self.apps = max(1, apps)
+        self.controls = max(1, controls)
+        self.uia_delay = uia_delay
+        self._placed = {}
+        self._focus = None
+        self._lock = threading.Lock()
+
+    def _synthetic(self, x, y):
+        app = int(x) * self.apps // 1920 % self.apps
+        idx = int(y) * self.controls // 1080 % self.controls
+        ctx = {
+            "app": f"app{app}.exe",
+            "pid": 1000 + app,
+            "window_title": f"Janela {app}",
+            "control_type": "EditControl" if idx % 3 else "ButtonControl",
+            "control_name": f"Controle {idx}",
+            "automation_id": f"ctl{idx}",
+            "bbox": None,
+            "path": [f"WindowControl:Janela {app}", f"PaneControl:Painel {idx // 5}"],
+        }
+        return SyntheticControl((app, idx), ctx)
+
+    def place(self, x, y, ctx):
+        """Registra o contexto gravado para a posição (x,y)."""
+        ctrl = SyntheticControl(("rec", ctx.get("app"), ctx.get("control_name"), ctx.get("automation_id")), ctx)
+        with self._lock:
+            self._placed[(int(x), int(y))] = ctrl
+
+    def set_focus(self, ctx):
+        ctrl = SyntheticControl(("rec", ctx.get("app"), ctx.get("control_name"), ctx.get("automation_id")), ctx)
+        with self._lock:
+            self._focus = ctrl
+
+    def control_from_point(self, x, y):
+        with self._lock:
+            ctrl = self._placed.pop((int(x), int(y)), None) or self._synthetic(x, y)
+            self._focus = ctrl
+        return ctrl
+
+    def focused_control(self):
+        with self._lock:
+            if self._focus is None:
+                self._focus = self._synthetic(0, 0)
+            return self._focus
+
+    def control_key(self, ctrl):
+        return ctrl.key
+
+    def read_context(self, ctrl, profile=None):
+        profile = PROFILE if profile is None else profile
+        if self.uia_delay:
+            time.sleep(self.uia_delay)
+        data = {f: ctrl.ctx.get(f) for f in profile["fields"]}
+        if profile["bbox"]:
+            data["bbox"] = ctrl.ctx.get("bbox")
+        return data
+
+    def control_path(self, ctrl):
+        return list(ctrl.ctx.get("path") or [])
+
+    def thread_scope(self):
+        return contextlib.nullcontext()
+
+
+PROVIDER = UIAContextProvider()
+
+
+def _cached_context(ctrl, cache, provider, focus=False, profile=None):
+    profile = PROFILE if profile is None else profile
+    key = provider.control_key(ctrl)
+    if focus:
+        cache.note_focus(key)
+    data = cache.get(key)
+    if data is None:
+        t0 = time.perf_counter()
+        data = intern_context(provider.read_context(ctrl, profile))
+        STATS.record("read_context", time.perf_counter() - t0)
+        cache.put(key, data)
+    if profile["path"]:
+        path = PATHS.path_for(key, lambda: _timed_path(provider, ctrl), profile["path"])
+        if path is not None:
+            data = {**data, "path": path}
+    return data
+
+
+def context_from_point(x, y, cache=None, provider=None):
     """Extrai metadados do controle sob o cursor (x,y)."""
+    cache = CONTEXT_CACHE if cache is None else cache
+    provider = PROVIDER if provider is None else provider
     try:
-        ctrl = uia.ControlFromPoint((int(x), int(y)))
+        t0 = time.perf_counter()
+        ctrl = provider.control_from_point(x, y)
+        STATS.record("control_from_point", time.perf_counter() - t0)
         if not ctrl:
             return None
-        top = ctrl.GetTopWindowControl() or ctrl
-        data = {
-            "app": proc_name(ctrl.ProcessId),
-            "pid": ctrl.ProcessId,
-            "window_title": (top.Name or "").strip(),
-            "control_type": ctrl.ControlTypeName,
-            "control_name": (ctrl.Name or "").strip(),
-            "automation_id": (ctrl.AutomationId or "").strip(),
-            "bbox": bbox_to_dict(ctrl.BoundingRectangle),
-            "path": control_path(ctrl),
-        }
-        return data
+        return _cached_context(ctrl, cache, provider)
     except Exception:
         return None
 
 
-def context_from_focus():
+def context_from_focus(cache=None, provider=None):
     """Extrai metadados do controle com foco atual (para keypress)."""
+    cache = CONTEXT_CACHE if cache is None else cache
+    provider = PROVIDER if provider is None else provider
     try:
-        ctrl = uia.GetFocusedControl()
+        t0 = time.perf_counter()
+        ctrl = provider.focused_control()
+        STATS.record("focused_control", time.perf_counter() - t0)
         if not ctrl:
             return None
-        top = ctrl.GetTopWindowControl() or ctrl
-        data = {
-            "app": proc_name(ctrl.ProcessId),
-            "pid": ctrl.ProcessId,
-            "window_title": (top.Name or "").strip(),
-            "control_type": ctrl.ControlTypeName,
-            "control_name": (ctrl.Name or "").strip(),
-            "automation_id": (ctrl.AutomationId or "").strip(),
-            "bbox": bbox_to_dict(ctrl.BoundingRectangle),
-            "path": control_path(ctrl),
-        }
-        return data
+        return _cached_context(ctrl, cache, provider, focus=True)
     except Exception:
         return None
 
 
+# -------- Captura (hook) → resolução (workers) --------
+
+# Registro bruto gravado nos callbacks do pynput: só dados baratos, sem UIA.
+# mono = time.monotonic() e wall = time.time() no instante do hook.
+RawInput = namedtuple("RawInput", ["kind", "x", "y", "detail", "mono", "wall"])
+
+
+class CaptureBuffer:
+    """Ring buffer limitado entre os hooks de entrada e os resolvers.
+
+    O hook nunca bloqueia: com o buffer cheio, o registro mais antigo é
+    sobrescrito e contabilizado em ``overwritten``.
+    """
+
+    def __init__(self, maxlen=4096):
+        self._items = deque(maxlen=maxlen)
+        self._cond = threading.Condition()
+        self.pushed = 0
+        self.overwritten = 0
+        self.closed = False
+
+    def push(self, item):
+        with self._cond:
+            self.pushed += 1
+            if len(self._items) == self._items.maxlen:
+                self.overwritten += 1
+            self._items.append(item)
+            self._cond.notify()
+
+    def pop(self, timeout=None):
+        """Retorna o próximo registro ou None se nada chegar em ``timeout``."""
+        with self._cond:
+            if not self._items and not self.closed:
+                self._cond.wait(timeout)
+            if not self._items:
+                return None
+            return self._items.popleft()
+
+    def close(self):
+        """Acorda os consumidores; pop() passa a não esperar mais."""
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+    def __len__(self):
+        return len(self._items)
+
+
+class ResolverPool:
+    """Threads que consomem o CaptureBuffer e fazem o trabalho UIA/psutil.
+
+    ``handler(raw)`` recebe cada RawInput e é responsável por resolver o
+    contexto e publicar o evento com o timestamp original do hook.
+
+    Com mais de um worker os registros são resolvidos fora de ordem. As
+    etapas com estado (TypingCoalescer, Deduplicator, PathTracker e o foco
+    do ContextCache) assumem ordem de chegada, por isso o padrão é 1.
+    """
+
+    def __init__(self, buffer, handler, workers=1, scope=None):
+        self.buffer = buffer
+        self.handler = handler
+        self.scope = scope or PROVIDER.thread_scope
+        self.stop_event = threading.Event()
+        self.threads = [
+            threading.Thread(target=self._run, daemon=True, name=f"uia-resolver-{i}")
+            for i in range(max(1, workers))
+        ]
+
+    def start(self):
+        for t in self.threads:
+            t.start()
+
+    def _run(self):
+        with self.scope():
+            while True:
+                # sem timeout: a thread dorme até chegar input (ou stop())
+                raw = self.buffer.pop()
+                if raw is None:
+                    if self.stop_event.is_set():
+                        break
+                    continue
+                try:
+                    self.handler(raw)
+                except Exception:
+                    pass
+
+    def stop(self):
+        # drena o que já foi capturado antes de encerrar
+        self.stop_event.set()
+        self.buffer.close()
+        for t in self.threads:
+            t.join(timeout=2)
+
+
+# -------- Pausa --------
+class PauseState:
+    """Estado de pausa em memória.
+
+    Uma thread em segundo plano verifica o arquivo sentinela a cada
+    ``interval`` segundos; os callbacks do hook só leem ``paused``.
+    """
+
+    def __init__(self, pausefile, interval=1.0):
+        self.pausefile = pausefile
+        self.interval = interval
+        self.paused = self._check()
+        self._stop = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True, name="uia-pause-watch")
+
+    def _check(self):
+        try:
+            return os.path.exists(self.pausefile)
+        except Exception:
+            return False
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            paused = self._check()
+            if paused != self.paused:
+                self.paused = paused
+                print(f"[uia-watcher] {'Pausado' if paused else 'Retomado'}.")
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+
+class StopRequest:
+    """Pedido de parada por arquivo sentinela (``--stopfile``).
+
+    No Windows o terminate() é TerminateProcess, que não roda nenhum
+    ``finally``: o workbench cria o arquivo e espera o watcher sair sozinho,
+    depois de drenar filas, rajadas pendentes e spool.
+    """
+
+    def __init__(self, stopfile, interval=0.5):
+        self.stopfile = stopfile
+        self.interval = interval
+        self.event = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True, name="uia-stop-watch")
+
+    def _run(self):
+        while not self.event.wait(self.interval):
+            if os.path.exists(self.stopfile):
+                print("[uia-watcher] Parada solicitada.")
+                self.event.set()
+
+    @property
+    def requested(self):
+        return self.event.is_set()
+
+    def start(self):
+        if self.stopfile:
+            self.thread.start()
+
+
+# -------- Deduplicação e limite por aplicativo --------
+class Deduplicator:
+    """Funde inputs idênticos dentro de ``window`` segundos em um só evento.
+
+    O evento resolvido fica pendente; repetições com a mesma chave (ex.:
+    mesmo botão na mesma posição, mesma categoria de tecla no mesmo
+    controle) só incrementam ``repeat``. Para cliques a chave é bruta, então
+    a repetição nem chega a consultar a UIA. O pendente é emitido quando
+    chega outro input, quando a janela expira ou no flush final.
+    """
+
+    def __init__(self, emit, window=0.3):
+        self.emit = emit
+        self.window = window
+        self._lock = threading.Lock()
+        self._pending = None
+
+    def merge(self, key, raw):
+        """True se ``raw`` foi contado como repetição do evento pendente."""
+        with self._lock:
+            p = self._pending
+            if p is None or p["key"] != key or raw.mono - p["last_mono"] > self.window:
+                return False
+            p["count"] += 1
+            p["last_mono"] = max(p["last_mono"], raw.mono)
+            p["last_wall"] = max(p["last_wall"], raw.wall)
+            return True
+
+    def hold(self, key, raw, event):
+        """Guarda ``event`` como pendente e emite o anterior."""
+        with self._lock:
+            prev = self._pending
+            self._pending = {"key": key, "event": event, "count": 1, "first_wall": raw.wall,
+                             "last_mono": raw.mono, "last_wall": raw.wall}
+        if prev is not None:
+            self._emit(prev)
+
+    def flush_expired(self, now_mono=None):
+        now_mono = time.monotonic() if now_mono is None else now_mono
+        with self._lock:
+            p = self._pending
+            if p is None or now_mono - p["last_mono"] <= self.window:
+                return
+            self._pending = None
+        self._emit(p)
+
+    def flush(self):
+        with self._lock:
+            p, self._pending = self._pending, None
+        if p is not None:
+            self._emit(p)
+
+    def _emit(self, p):
+        event = p["event"]
+        if p["count"] > 1:
+            event.extra = {**(event.extra or {}), "repeat": p["count"]}
+            event.duration = max(0.0, p["last_wall"] - p["first_wall"])
+        self.emit(event)
+
+
+def parse_rate_limits(spec):
+    """Converte "EXCEL.EXE=20;chrome.exe=5;*=50" em {app_minúsculo: eventos/s}.
+
+    Mesmo formato de lista do --allow; ``*`` vale para os demais aplicativos.
+    """
+    rates = {}
+    for part in (spec or "").split(";"):
+        name, sep, value = part.strip().partition("=")
+        if not sep or not name.strip():
+            continue
+        try:
+            rates[name.strip().lower()] = float(value)
+        except ValueError:
+            raise SystemExit(f"--rate-limit inválido: {part!r}")
+    return rates
+
+
+class AppRateLimiter:
+    """Token bucket por aplicativo (nome do processo).
+
+    Cada aplicativo recebe ``rate`` eventos/s com rajada de até
+    ``burst`` x rate; aplicativos sem regra usam ``*`` ou ficam livres.
+    """
+
+    def __init__(self, rates, burst=2.0):
+        self.rates = rates
+        self.burst = burst
+        self._buckets = {}  # app -> [tokens, last_mono]
+        self._lock = threading.Lock()
+        self.limited = 0
+
+    def allow(self, app, now_mono=None):
+        name = (app or "").lower()
+        rate = self.rates.get(name, self.rates.get("*"))
+        if rate is None:
+            return True
+        now_mono = time.monotonic() if now_mono is None else now_mono
+        capacity = max(1.0, rate * self.burst)
+        with self._lock:
+            bucket = self._buckets.get(name)
+            if bucket is None:
+                bucket = self._buckets[name] = [capacity, now_mono]
+            bucket[0] = min(capacity, bucket[0] + (now_mono - bucket[1]) * rate)
+            bucket[1] = now_mono
+            if bucket[0] >= 1.0:
+                bucket[0] -= 1.0
+                return True
+            self.limited += 1
+            return False
+
+
+# -------- Ausência (AFK) --------
+class IdleMonitor:
+    """Detecta ausência (AFK) por inatividade de input.
+
+    ``touch()`` roda no hook e só faz atribuições; ``check()`` roda no loop
+    principal. ``on_afk_start(mono, wall)`` recebe o instante do último input
+    e ``on_afk_end(mono, wall, idle_seconds)`` o do input que encerrou a ausência.
+    """
+
+    def __init__(self, timeout, on_afk_start, on_afk_end):
+        self.timeout = timeout
+        self.on_afk_start = on_afk_start
+        self.on_afk_end = on_afk_end
+        self.last_mono = time.monotonic()
+        self.last_wall = time.time()
+        self.afk = False
+        self._lock = threading.Lock()
+
+    def touch(self, mono, wall):
+        self.last_mono = mono
+        self.last_wall = wall
+        if self.afk:
+            with self._lock:
+                if not self.afk:
+                    return
+                self.afk = False
+                since = self._afk_since
+            self.on_afk_end(mono, wall, max(0.0, wall - since))
+
+    def check(self, now_mono=None):
+        if self.afk or self.timeout <= 0:
+            return
+        now_mono = time.monotonic() if now_mono is None else now_mono
+        with self._lock:
+            if self.afk or now_mono - self.last_mono <= self.timeout:
+                return
+            self.afk = True
+            self._afk_since = self.last_wall
+            mono, wall = self.last_mono, self.last_wall
+        self.on_afk_start(mono, wall)
+
+
+# -------- Agrupamento de digitação --------
+class TypingCoalescer:
+    """Agrupa key_press consecutivos no mesmo controle em um evento "typing".
+
+    Uma rajada é fechada quando o foco muda para outro controle, quando
+    ``flush()`` é chamado (ex.: num clique) ou após ``idle_gap`` segundos
+    sem teclas (verificado por ``flush_idle()``). ``emit(wall, duration, data)``
+    recebe cada rajada fechada.
+    """
+
+    KEY_FIELDS = ("app", "pid", "window_title", "control_type", "control_name", "automation_id")
+
+    def __init__(self, emit, idle_gap=2.0):
+        self.emit = emit
+        self.idle_gap = idle_gap
+        self._lock = threading.Lock()
+        self._burst = None
+
+    def add(self, raw, ctx):
+        key = tuple(ctx.get(f) for f in self.KEY_FIELDS)
+        done = None
+        with self._lock:
+            b = self._burst
+            if b is not None and (b["key"] != key or raw.mono - b["last_mono"] > self.idle_gap):
+                done, b = b, None
+            if b is None:
+                b = self._burst = {
+                    "key": key,
+                    "ctx": ctx,
+                    "first_mono": raw.mono,
+                    "last_mono": raw.mono,
+                    "first_wall": raw.wall,
+                    "last_wall": raw.wall,
+                    "alpha": 0,
+                    "control": 0,
+                }
+            # resolvers em paralelo podem entregar fora de ordem
+            b["first_mono"] = min(b["first_mono"], raw.mono)
+            b["last_mono"] = max(b["last_mono"], raw.mono)
+            b["first_wall"] = min(b["first_wall"], raw.wall)
+            b["last_wall"] = max(b["last_wall"], raw.wall)
+            b["control" if raw.detail == "control" else "alpha"] += 1
+        if done is not None:
+            self._emit(done)
+
+    def flush_idle(self, now_mono=None):
+        now_mono = time.monotonic() if now_mono is None else now_mono
+        with self._lock:
+            b = self._burst
+            if b is None or now_mono - b["last_mono"] <= self.idle_gap:
+                return
+            self._burst = None
+        self._emit(b)
+
+    def flush(self):
+        with self._lock:
+            b, self._burst = self._burst, None
+        if b is not None:
+            self._emit(b)
+
+    def _emit(self, b):
+        extra = {
+            "keystrokes": b["alpha"] + b["control"],
+            "alpha_count": b["alpha"],
+            "control_count": b["control"],
+            "start": _utc_iso(b["first_wall"]),
+            "end": _utc_iso(b["last_wall"]),
+        }
+        self.emit(UIAEvent(b["first_wall"], "typing", b["ctx"], extra=extra,
+                           duration=max(0.0, b["last_wall"] - b["first_wall"])))
+
+
+# -------- Spool em disco --------
+class EventSpool:
+    """Spool append-only em disco para eventos que não chegaram ao aw-server.
+
+    Cada segmento é um arquivo JSONL (um evento por linha), rotacionado por
+    tamanho. O reenvio lê o segmento mais antigo em blocos de ``chunk``
+    eventos (memória limitada), grava o progresso em um arquivo ``.pos`` ao
+    lado e remove o segmento quando termina. Sobrevive a reinícios do watcher.
+    """
+
+    def __init__(self, directory, segment_bytes=4 * 1024 * 1024, max_bytes=512 * 1024 * 1024):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._fh = None
+        self._seq = 0
+        self.spooled = 0
+        self.replayed = 0
+        self.dropped = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _segments(self):
+        return sorted(
+            os.path.join(self.directory, f)
+            for f in os.listdir(self.directory)
+            if f.startswith("seg_") and f.endswith(".jsonl")
+        )
+
+    def _size(self):
+        total = 0
+        for path in self._segments():
+            try:
+                total += os.path.getsize(path)
+            except OSError:
+                pass
+        return total
+
+    def _close_current(self):
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+
+    def append(self, events):
+        """Grava eventos no segmento corrente. Retorna quantos foram gravados."""
+        if not events:
+            return 0
+        lines = b"".join(json.dumps(wire(ev), ensure_ascii=False).encode("utf-8") + b"\n" for ev in events)
+        with self._lock:
+            try:
+                if self._fh is None and self._size() + len(lines) > self.max_bytes:
+                    self.dropped += len(events)
+                    return 0
+                if self._fh is None:
+                    self._seq += 1
+                    name = f"seg_{time.time_ns():020d}_{self._seq:04d}.jsonl"
+                    self._fh = open(os.path.join(self.directory, name), "ab")
+                self._fh.write(lines)
+                self._fh.flush()
+                if self._fh.tell() >= self.segment_bytes:
+                    self._close_current()
+            except OSError:
+                self.dropped += len(events)
+                return 0
+            self.spooled += len(events)
+            return len(events)
+
+    def pending(self):
+        with self._lock:
+            return bool(self._segments())
+
+    def replay(self, send, chunk=200, max_chunks=10):
+        """Reenvia até ``max_chunks`` blocos via ``send(events)``.
+
+        Para no primeiro erro de envio (o progresso já confirmado é mantido).
+        O segmento aberto é lido até onde já foi gravado, sem fechá-lo; só é
+        fechado e removido depois de todo reenviado. Assim uma queda longa do
+        aw-server não cria um segmento novo a cada tentativa.
+        Retorna o número de eventos reenviados nesta chamada.
+        """
+        sent = 0
+        with self._lock:
+            segments = self._segments()
+            active = self._fh.name if self._fh is not None else None
+            active_end = self._fh.tell() if self._fh is not None else None
+        for path in segments:
+            limit = active_end if path == active else None
+            pos_path = path + ".pos"
+            try:
+                with open(pos_path, "r", encoding="ascii") as f:
+                    pos = int(f.read().strip() or 0)
+            except (OSError, ValueError):
+                pos = 0
+            with open(path, "rb") as f:
+                f.seek(pos)
+                while max_chunks > 0:
+                    events = []
+                    while limit is None or f.tell() < limit:
+                        line = f.readline()
+                        if not line:
+                            break
+                        line = line.strip()
+                        if line:
+                            try:
+                                events.append(json.loads(line.decode("utf-8")))
+                            except ValueError:
+                                pass
+                        if len(events) >= chunk:
+                            break
+                    if not events:
+                        break
+                    send(events)  # exceção interrompe o reenvio
+                    max_chunks -= 1
+                    sent += len(events)
+                    with self._lock:
+                        self.replayed += len(events)
+                    with open(pos_path, "w", encoding="ascii") as pf:
+                        pf.write(str(f.tell()))
+                finished = f.tell() >= limit if limit is not None else not f.read(1)
+            if not finished:
+                break
+            if limit is not None:
+                with self._lock:
+                    # fecha o segmento aberto só se nada foi gravado depois da leitura
+                    if self._fh is None or self._fh.name != path or self._fh.tell() != limit:
+                        break
+                    self._close_current()
+            for done in (path, pos_path):
+                try:
+                    os.remove(done)
+                except OSError:
+                    pass
+        return sent
+
+    def close(self):
+        with self._lock:
+            self._close_current()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "spooled": self.spooled,
+                "replayed": self.replayed,
+                "dropped": self.dropped,
+                "segments": len(self._segments()),
+            }
+
+
 # -------- Worker de envio para ActivityWatch --------
+def to_aw_events(batch):
+    """Serializa o lote no formato do aw-server (única conversão por evento)."""
+    events = []
+    for ev in batch:
+        ev = wire(ev)
+        events.append(Event(timestamp=ev["timestamp"], duration=ev.get("duration", 0), data=ev["data"]))
+    return events
+
+
+# Campos que mudam a cada evento (contadores de digitação, 'repeat' do
+# dedup). No heartbeat o aw-server só funde eventos de ``data`` idêntico e
+# guarda o ``data`` do primeiro, então esses campos ficam fora do payload;
+# a duração do evento fundido já cobre o que eles contavam.
+HEARTBEAT_VOLATILE = ("keystrokes", "alpha_count", "control_count", "start", "end", "repeat")
+HEARTBEAT_DRAIN_TIMEOUT = 10.0  # s esperando a fila de heartbeats do aw_client na parada
+
+
+def heartbeat_events(events):
+    """Remove de cada evento os campos de HEARTBEAT_VOLATILE."""
+    for ev in events:
+        if any(k in ev.data for k in HEARTBEAT_VOLATILE):
+            ev.data = {k: v for k, v in ev.data.items() if k not in HEARTBEAT_VOLATILE}
+    return events
+
+
+def merge_heartbeats(events, pulsetime):
+    """Pré-funde, em ordem de timestamp, eventos consecutivos de mesmo ``data``.
+
+    Mesma regra do heartbeat do aw-server: o seguinte é absorvido se começar
+    até ``pulsetime`` segundos depois do fim do anterior. Reduz o número de
+    requisições; o aw_client ainda funde o primeiro do lote com o heartbeat
+    pendente do lote anterior.
+    """
+    pulse = timedelta(seconds=pulsetime)
+    merged = []
+    for ev in sorted(events, key=lambda e: e.timestamp):
+        last = merged[-1] if merged else None
+        if (last is not None and last.data == ev.data
+                and last.timestamp <= ev.timestamp <= last.timestamp + last.duration + pulse):
+            last.duration = max(last.duration, ev.timestamp - last.timestamp + ev.duration)
+        else:
+            merged.append(ev)
+    return merged
+
+
+def _percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    idx = min(len(sorted_values) - 1, max(0, int(round(q / 100.0 * (len(sorted_values) - 1)))))
+    return sorted_values[idx]
+
+
 class AWPublisher:
-    def __init__(self, bucket_id, bucket_type="uia.event", host="127.0.0.1", port=5600):
+    """Envia eventos ao aw-server em lotes de tamanho adaptativo.
+
+    O tamanho alvo do lote cresce (até ``batch_max``) enquanto houver fila
+    acumulada e os inserts forem rápidos, e encolhe (até ``batch_min``)
+    quando a latência do insert passa de ``slow_insert`` segundos ou o volume
+    cai. Um lote espera no máximo ``linger`` segundos por mais eventos; o
+    linger acompanha a latência observada, limitado a ``flush_interval``.
+
+    Com ``heartbeat_pulsetime`` os eventos vão pela API de heartbeat: eventos
+    consecutivos com o mesmo contexto viram um único evento com duração no
+    bucket, em vez de uma linha por clique/tecla. Os heartbeats são
+    enfileirados no aw_client (``queued=True``), que funde com o anterior e
+    envia numa thread própria, em ordem: a publicação não espera uma
+    requisição por evento. Heartbeat e insert não se misturam no mesmo bucket
+    (o aw-server guarda o último heartbeat em cache e não o invalida no
+    insert). Contadores por evento (HEARTBEAT_VOLATILE) não são enviados
+    nesse modo.
+    """
+
+    def __init__(self, bucket_id, bucket_type="uia.event", host="127.0.0.1", port=5600,
+                 spool=None, replay_interval=5.0, batch_min=20, batch_max=1000,
+                 flush_interval=1.0, slow_insert=0.5, heartbeat_pulsetime=None):
         self.client = ActivityWatchClient("aw-watcher-uia", host=host, port=port)
+        self.heartbeat_pulsetime = heartbeat_pulsetime
         self.bucket_id = bucket_id
         self.bucket_type = bucket_type
+        self.spool = spool
+        self.replay_interval = replay_interval
+        self.batch_min = max(1, batch_min)
+        self.batch_max = max(self.batch_min, batch_max)
+        self.flush_interval = flush_interval
+        self.slow_insert = slow_insert
         self.queue = queue.Queue(maxsize=10000)
         self.stop_event = threading.Event()
+        self.parked = threading.Event()
         self.thread = threading.Thread(target=self._run, daemon=True)
+        self._bucket_ready = False
+        self._stats_lock = threading.Lock()
+        self._target = self.batch_min
+        self._latency_ewma = 0.0
+        self._latencies = deque(maxlen=1024)
+        self._batch_sizes = {}  # potência de 2 -> contagem
+        self.max_queue_depth = 0
+        self.inserts = 0
+        self.published = 0
+        self.dropped = 0
+        self.heartbeats = 0
 
     def start(self):
+        if self.heartbeat_pulsetime:
+            # a fila do aw_client cria o bucket ao (re)conectar
+            self.client.create_bucket(self.bucket_id, self.bucket_type, queued=True)
         self.client.connect()
+        self._ensure_bucket()
+        self.thread.start()
+
+    def _ensure_bucket(self):
+        if self._bucket_ready:
+            return True
         try:
-            self.client.create_bucket(self.bucket_id, self.bucket_type, event_schema={})
+            # create_bucket é idempotente no aw-server (bucket existente → 304)
+            self.client.create_bucket(self.bucket_id, event_type=self.bucket_type)
+            self._bucket_ready = True
         except Exception:
-            # bucket já existe
             pass
-        self.thread.start()
+        return self._bucket_ready
+
+    def _send(self, batch):
+        events = to_aw_events(batch)
+        if self.heartbeat_pulsetime:
+            # só enfileira (fila persistente do aw_client); não falha com o
+            # servidor fora, então esses lotes não passam pelo spool
+            merged = merge_heartbeats(heartbeat_events(events), self.heartbeat_pulsetime)
+            for ev in merged:
+                self.client.heartbeat(self.bucket_id, ev, pulsetime=self.heartbeat_pulsetime, queued=True)
+            with self._stats_lock:
+                self.heartbeats += len(merged)
+            return
+        if not self._ensure_bucket():
+            raise ConnectionError("aw-server indisponível")
+        self.client.insert_events(self.bucket_id, events)
+
+    def _drain_heartbeats(self, timeout=HEARTBEAT_DRAIN_TIMEOUT):
+        """Enfileira o heartbeat ainda pendente no aw_client e espera a fila esvaziar.
+
+        O que não sair em ``timeout`` segundos fica na fila em disco do
+        aw_client e é enviado na próxima execução.
+        """
+        pending = self.client.last_heartbeat.pop(self.bucket_id, None)
+        rq = self.client.request_queue
+        if pending is not None:
+            rq.add_request(f"buckets/{self.bucket_id}/heartbeat?pulsetime={self.heartbeat_pulsetime}",
+                           pending.to_json_dict())
+        backlog = getattr(rq, "_persistqueue", None)
+        deadline = time.monotonic() + timeout
+        while (backlog is not None and rq.is_alive() and time.monotonic() < deadline
+               and (backlog.qsize() or getattr(rq, "_current", None) is not None)):
+            time.sleep(0.1)
+        self.client.disconnect()
+
+    def _flush(self, batch):
+        """Envia um lote; em caso de falha o lote vai para o spool."""
+        t0 = time.perf_counter()
+        try:
+            self._send(batch)
+        except Exception:
+            self._bucket_ready = False
+            self._to_spool(batch)
+            self._adapt(time.perf_counter() - t0, len(batch), failed=True)
+            return False
+        latency = time.perf_counter() - t0
+        with self._stats_lock:
+            self.published += len(batch)
+            self.inserts += 1
+            self._latencies.append(latency)
+            bucket = 1 << (len(batch) - 1).bit_length()
+            self._batch_sizes[bucket] = self._batch_sizes.get(bucket, 0) + 1
+        self._adapt(latency, len(batch))
+        return True
+
+    def _adapt(self, latency, size, failed=False):
+        self._latency_ewma = latency if not self._latency_ewma else 0.8 * self._latency_ewma + 0.2 * latency
+        depth = self.queue.qsize()
+        if failed or latency > self.slow_insert:
+            self._target = max(self.batch_min, self._target // 2)
+        elif depth > self._target:
+            self._target = min(self.batch_max, self._target * 2)
+        elif size < self._target // 4:
+            self._target = max(self.batch_min, int(self._target * 0.75))
+
+    def _linger(self):
+        return min(self.flush_interval, max(0.05, 2 * self._latency_ewma))
+
+    def _to_spool(self, batch):
+        stored = self.spool.append(batch) if self.spool is not None else 0
+        if stored < len(batch):
+            with self._stats_lock:
+                self.dropped += len(batch) - stored
+
+    def _replay(self):
+        try:
+            self.spool.replay(self._send)
+        except Exception:
+            # servidor ainda fora; tenta de novo no próximo intervalo
+            self._bucket_ready = False
+
+    def _take(self, timeout):
+        item = self.queue.get(timeout=timeout)
+        return None if item is _STOP else item
 
     def _run(self):
-        batch = []
-        last_flush = time.time()
+        last_replay = 0.0
         while not self.stop_event.is_set():
+            # sem eventos, a thread fica bloqueada (sem polling) até o próximo
+            # reenvio; estacionada (AFK), só acorda com um novo evento
+            batch = []
             try:
-                item = self.queue.get(timeout=0.5)
-                batch.append(item)
+                item = self._take(None if self.parked.is_set() else self.replay_interval)
+                if item is not None:
+                    batch.append(item)
             except queue.Empty:
                 pass
-            # flush a cada 1s ou 200 eventos
-            if batch and (time.time() - last_flush > 1.0 or len(batch) >= 200):
-                try:
-                    self.client.insert_events(self.bucket_id, batch)
-                except Exception as e:
-                    # opcional: logar e re-enfileirar
-                    pass
-                batch = []
-                last_flush = time.time()
-        # flush final
-        if batch:
+            if batch:
+                depth = self.queue.qsize()
+                if depth > self.max_queue_depth:
+                    self.max_queue_depth = depth
+                deadline = time.monotonic() + self._linger()
+                while len(batch) < self._target and not self.stop_event.is_set():
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        item = self._take(remaining)
+                    except queue.Empty:
+                        break
+                    if item is not None:
+                        batch.append(item)
+                self._flush(batch)
+            if (self.spool is not None and not self.parked.is_set()
+                    and time.monotonic() - last_replay > self.replay_interval):
+                last_replay = time.monotonic()
+                if self.spool.pending():
+                    self._replay()
+        # flush final (o que falhar fica no spool para a próxima execução)
+        batch = []
+        while True:
             try:
-                self.client.insert_events(self.bucket_id, batch)
-            except Exception:
-                pass
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _STOP:
+                batch.append(item)
+        for i in range(0, len(batch), self.batch_max):
+            self._flush(batch[i:i + self.batch_max])
+        if self.heartbeat_pulsetime:
+            self._drain_heartbeats()
+        if self.spool is not None:
+            self.spool.close()
 
     def publish(self, event):
         try:
             self.queue.put_nowait(event)
         except queue.Full:
-            pass
+            # fila cheia: o evento vai direto para o spool em disco
+            self._to_spool([event])
+
+    def park(self):
+        """Suspende os despertares periódicos (reenvio do spool) enquanto AFK."""
+        self.parked.set()
+
+    def unpark(self):
+        self.parked.clear()
+
+    def stats(self):
+        with self._stats_lock:
+            lat = sorted(self._latencies)
+            stats = {
+                "published": self.published,
+                "dropped": self.dropped,
+                "inserts": self.inserts,
+                "queue_depth": self.queue.qsize(),
+                "max_queue_depth": self.max_queue_depth,
+                "batch_target": self._target,
+                "batch_sizes": dict(sorted(self._batch_sizes.items())),
+                "insert_ms": {
+                    f"p{q}": round(_percentile(lat, q) * 1000, 2) if lat else None
+                    for q in (50, 95, 99)
+                },
+            }
+            if self.heartbeat_pulsetime:
+                stats["heartbeats"] = self.heartbeats
+        if self.spool is not None:
+            stats["spool"] = self.spool.stats()
+        return stats
 
     def stop(self):
         self.stop_event.set()
-        self.thread.join(timeout=2)
+        try:
+            self.queue.put_nowait(_STOP)  # acorda a thread bloqueada no get()
+        except queue.Full:
+            pass
+        self.thread.join(timeout=2 + (HEARTBEAT_DRAIN_TIMEOUT if self.heartbeat_pulsetime else 0))
+
+
+# sentinela para encerrar o AWPublisher sem polling
+_STOP = object()
+
+
+# -------- Layout em dois processos (captura | envio) --------
+class ShmRing:
+    """Ring buffer SPSC em ``multiprocessing.shared_memory`` com slots fixos.
+
+    Cabeçalho: head (escritos), tail (lidos), dropped (descartados pelo
+    produtor), slots e slot_size. Cada slot guarda um u32 com o tamanho e o
+    evento em JSON. Um processo escreve (captura) e outro lê (envio); quem
+    chegar primeiro cria o segmento e o processo de envio o remove ao sair.
+    """
+
+    HEADER = struct.Struct("<QQQII")
+    LEN = struct.Struct("<I")
+
+    def __init__(self, name, slots=8192, slot_size=2048):
+        self.name = name
+        try:
+            self.shm = shared_memory.SharedMemory(name=name)
+            self.owner = False
+        except FileNotFoundError:
+            self.shm = shared_memory.SharedMemory(name=name, create=True,
+                                                  size=self.HEADER.size + slots * slot_size)
+            self.owner = True
+            self.HEADER.pack_into(self.shm.buf, 0, 0, 0, 0, slots, slot_size)
+        if not self.owner:
+            self._untrack()
+            # o criador pode ainda estar gravando o cabeçalho
+            for _ in range(100):
+                if self.HEADER.unpack_from(self.shm.buf, 0)[3]:
+                    break
+                time.sleep(0.01)
+        _, _, _, self.slots, self.slot_size = self.HEADER.unpack_from(self.shm.buf, 0)
+        self._lock = threading.Lock()
+
+    def _untrack(self):
+        # No POSIX o resource_tracker remove o segmento quando um processo que
+        # só o anexou termina; aqui só o processo de envio deve removê-lo.
+        try:
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(self.shm._name, "shared_memory")
+        except Exception:
+            pass
+
+    def _get(self, field):
+        return struct.unpack_from("<Q", self.shm.buf, field * 8)[0]
+
+    def _set(self, field, value):
+        struct.pack_into("<Q", self.shm.buf, field * 8, value)
+
+    def push(self, event):
+        """Grava um evento. False se o ring está cheio ou o evento não cabe no slot."""
+        payload = json.dumps(wire(event), ensure_ascii=False).encode("utf-8")
+        with self._lock:
+            head, tail = self._get(0), self._get(1)
+            if len(payload) > self.slot_size - self.LEN.size or head - tail >= self.slots:
+                self._set(2, self._get(2) + 1)
+                return False
+            off = self.HEADER.size + (head % self.slots) * self.slot_size
+            self.LEN.pack_into(self.shm.buf, off, len(payload))
+            start = off + self.LEN.size
+            self.shm.buf[start:start + len(payload)] = payload
+            self._set(0, head + 1)  # publica o slot só depois de escrito
+            return True
+
+    def pop_many(self, max_items=500):
+        events = []
+        head, tail = self._get(0), self._get(1)
+        while tail < head and len(events) < max_items:
+            off = self.HEADER.size + (tail % self.slots) * self.slot_size
+            (length,) = self.LEN.unpack_from(self.shm.buf, off)
+            start = off + self.LEN.size
+            try:
+                events.append(json.loads(bytes(self.shm.buf[start:start + length]).decode("utf-8")))
+            except ValueError:
+                pass
+            tail += 1
+        self._set(1, tail)
+        return events
+
+    def depth(self):
+        return self._get(0) - self._get(1)
+
+    def stats(self):
+        return {"written": self._get(0), "read": self._get(1), "dropped": self._get(2),
+                "depth": self.depth(), "slots": self.slots}
+
+    def close(self, unlink=False):
+        try:
+            self.shm.close()
+            if unlink:
+                self.shm.unlink()
+        except Exception:
+            pass
+
+
+class RingPublisher:
+    """Lado da captura no layout em dois processos: entrega ao ShmRing.
+
+    Mesma interface usada do AWPublisher (publish/stats/start/stop).
+    """
+
+    def __init__(self, ring):
+        self.ring = ring
+        self.published = 0
+        self.dropped = 0
+        self._ring_stats = None  # congelado no stop(), após fechar o segmento
+
+    def start(self):
+        pass
+
+    def park(self):
+        pass
+
+    def unpark(self):
+        pass
+
+    def publish(self, event):
+        if self.ring.push(event):
+            self.published += 1
+        else:
+            self.dropped += 1
+
+    def stats(self):
+        ring = self._ring_stats or self.ring.stats()
+        return {
+            "published": self.published,
+            "dropped": self.dropped,
+            "queue_depth": ring["depth"],
+            "batch_target": None,
+            "insert_ms": {},
+            "ring": ring,
+        }
+
+    def stop(self):
+        self._ring_stats = self.ring.stats()
+        self.ring.close()
+
+
+def run_ring_publisher(ring, pub, report_interval=60.0, make_reporter=None, stop=None):
+    """Processo de envio: drena o ShmRing para o AWPublisher até ser interrompido
+    ou até ``stop`` (StopRequest) ser pedido."""
+    drained = 0
+    t0 = last = time.monotonic()
+    last_drained = 0
+    rate = 0.0
+
+    def collect():
+        return {"role": "publisher", "drained": drained, "drain_per_s": round(rate, 1),
+                "ring": ring.stats(), **pub.stats()}
+
+    reporter = make_reporter(collect) if make_reporter else None
+    idle_sleep = 0.01
+    print(f"[uia-publisher] Drenando ring '{ring.name}' ({ring.slots} slots).")
+    try:
+        while stop is None or not stop.requested:
+            events = ring.pop_many()
+            for ev in events:
+                pub.publish(ev)
+            drained += len(events)
+            now = time.monotonic()
+            if now - last >= report_interval:
+                rate = (drained - last_drained) / (now - last)
+                print(f"[uia-publisher] {rate:.1f} ev/s | ring: {ring.stats()}")
+                last, last_drained = now, drained
+            if events:
+                idle_sleep = 0.01
+            else:
+                # ring vazio (ex.: usuário AFK): recua até 0,5s entre verificações
+                time.sleep(idle_sleep)
+                idle_sleep = min(0.5, idle_sleep * 2)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for ev in ring.pop_many(max_items=ring.slots):
+            pub.publish(ev)
+            drained += 1
+        if reporter is not None:
+            reporter.stop()
+        pub.stop()
+        ring.close(unlink=True)
+        elapsed = time.monotonic() - t0
+        print(f"[uia-publisher] Total drenado: {drained} em {elapsed:.1f}s "
+              f"({drained / elapsed if elapsed else 0:.1f} ev/s). Publicação: {pub.stats()}")
+
+
+# -------- Fontes de entrada --------
+class PynputInputSource:
+    """Hooks globais de mouse e teclado (captura real)."""
+
+    def __init__(self, on_click, on_press):
+        if mouse is None or keyboard is None:
+            raise SystemExit("pynput não encontrado. pip install pynput")
+        self.mlistener = mouse.Listener(on_click=on_click)
+        self.klistener = keyboard.Listener(on_press=on_press)
+        self.done = threading.Event()  # nunca termina sozinho
+        self.offered = None
+
+    def start(self):
+        self.mlistener.start()
+        self.klistener.start()
+
+    def stop(self):
+        self.mlistener.stop()
+        self.klistener.stop()
+
+
+def synthetic_inputs(count, click_ratio=0.15, seed=0):
+    """Stream sintético de inputs no formato de gravação."""
+    rng = random.Random(seed)
+    for _ in range(count):
+        if rng.random() < click_ratio:
+            yield {"kind": "mouse_click", "x": rng.randrange(1920), "y": rng.randrange(1080),
+                   "detail": "Button.left"}
+        else:
+            yield {"kind": "key_press", "detail": "control" if rng.random() < 0.05 else "alpha"}
+
+
+def load_recording(path):
+    """Lê uma gravação JSONL produzida com --record."""
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+class InputRecorder:
+    """Grava inputs resolvidos (com contexto) em JSONL para replay posterior."""
+
+    def __init__(self, path):
+        self._fh = open(path, "a", encoding="utf-8")
+        self._lock = threading.Lock()
+        self._t0 = None
+
+    def write(self, raw, ctx):
+        with self._lock:
+            if self._t0 is None:
+                self._t0 = raw.mono
+            rec = {"kind": raw.kind, "x": raw.x, "y": raw.y, "detail": raw.detail,
+                   "t": round(raw.mono - self._t0, 4), "ctx": ctx}
+            self._fh.write(json.dumps(rec, ensure_ascii=False) + "\n")
+
+    def close(self):
+        with self._lock:
+            self._fh.close()
+
+
+class ReplayInputSource:
+    """Reproduz um stream de inputs nos mesmos callbacks usados pelo pynput.
+
+    ``rate`` > 0 fixa a taxa em inputs/s; com ``rate`` = 0 os offsets ``t``
+    da gravação são respeitados e, sem eles, o stream roda na velocidade
+    máxima. Contextos gravados são repassados ao ReplayContextProvider.
+    """
+
+    def __init__(self, records, on_click, on_press, provider=None, rate=0.0):
+        self.records = records
+        self.on_click = on_click
+        self.on_press = on_press
+        self.provider = provider
+        self.rate = rate
+        self.offered = 0
+        self.done = threading.Event()
+        self._stop = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True, name="uia-replay")
+
+    def _run(self):
+        t0 = time.monotonic()
+        try:
+            for i, rec in enumerate(self.records):
+                if self._stop.is_set():
+                    break
+                if self.rate > 0:
+                    due = t0 + i / self.rate
+                elif "t" in rec:
+                    due = t0 + float(rec["t"])
+                else:
+                    due = None
+                if due is not None:
+                    delay = due - time.monotonic()
+                    if delay > 0:
+                        self._stop.wait(delay)
+                ctx = rec.get("ctx")
+                if rec.get("kind") == "mouse_click":
+                    x, y = rec.get("x") or 0, rec.get("y") or 0
+                    if ctx and self.provider is not None:
+                        self.provider.place(x, y, ctx)
+                    self.on_click(x, y, rec.get("detail") or "Button.left", True)
+                else:
+                    if ctx and self.provider is not None:
+                        self.provider.set_focus(ctx)
+                    self.on_press(SimpleNamespace(vk=13 if rec.get("detail") == "control" else 65))
+                self.offered += 1
+        finally:
+            self.done.set()
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+
+# -------- aw-server substituto (carga/testes) --------
+class StandInAWServer:
+    """aw-server mínimo em memória para medir o pipeline sem o ActivityWatch.
+
+    Implementa só o que o AWPublisher usa (info, buckets, insert de eventos
+    e heartbeat) e conta o que recebe. ``delay`` simula a latência de cada
+    requisição de escrita.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, delay=0.0):
+        self.delay = delay
+        self.buckets = {}
+        self.received = 0
+        self.requests = 0
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, code, body=None):
+                payload = json.dumps(body if body is not None else {}).encode("utf-8")
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def _parts(self):
+                path = self.path.split("?", 1)[0].strip("/")
+                return path.split("/")[2:] if path.startswith("api/0") else []
+
+            def do_GET(self):
+                parts = self._parts()
+                if parts == ["info"]:
+                    return self._reply(200, {"hostname": "standin", "version": "standin", "testing": True})
+                if parts == ["buckets"]:
+                    with server._lock:
+                        return self._reply(200, dict(server.buckets))
+                if len(parts) == 2 and parts[0] == "buckets" and parts[1] in server.buckets:
+                    return self._reply(200, server.buckets[parts[1]])
+                return self._reply(404, {"message": "not found"})
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = json.loads(self.rfile.read(length) or b"null") if length else None
+                parts = self._parts()
+                if len(parts) >= 2 and parts[0] == "buckets":
+                    bid = parts[1]
+                    if len(parts) == 2:
+                        with server._lock:
+                            server.buckets.setdefault(bid, {"id": bid, **(body or {})})
+                        return self._reply(200)
+                    if server.delay:
+                        time.sleep(server.delay)
+                    if parts[2] in ("events", "heartbeat"):
+                        n = len(body) if isinstance(body, list) else 1
+                        with server._lock:
+                            server.requests += 1
+                            server.received += n
+                        return self._reply(200, body if parts[2] == "heartbeat" else None)
+                return self._reply(404, {"message": "not found"})
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.host, self.port = self.httpd.server_address[:2]
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True, name="aw-standin")
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def stats(self):
+        with self._lock:
+            return {"received": self.received, "requests": self.requests}
 
 
 # -------- Main listener --------
 
+def _interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
 def main():
     parser = argparse.ArgumentParser(description="ActivityWatch UIA watcher (desktop)")
     parser.add_argument("--allow", type=str, default="",
@@ -174,16 +1870,160 @@ def main():
     parser.add_argument("--bucket", type=str, default=None, help="Bucket ID opcional. Padrão: aw-watcher-uia_<HOST>")
     parser.add_argument("--pausefile", type=str, default="aw_uia.PAUSE",
                         help="Arquivo sentinela para pausar a captura se existir")
+    parser.add_argument("--stopfile", type=str, default=None,
+                        help="Arquivo sentinela: se existir, o watcher envia o pendente e encerra")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Threads que resolvem o contexto UIA fora dos hooks de entrada. "
+                             "Acima de 1 os eventos são resolvidos fora de ordem (rajadas de "
+                             "digitação, repetições e caminhos podem sair trocados)")
+    parser.add_argument("--buffer-size", type=int, default=4096,
+                        help="Capacidade do ring buffer entre hooks e resolvers")
+    parser.add_argument("--ctx-cache-size", type=int, default=256,
+                        help="Máximo de contextos de controle em cache (0 desativa)")
+    parser.add_argument("--ctx-cache-ttl", type=float, default=2.0,
+                        help="Validade (s) de um contexto de controle em cache")
+    parser.add_argument("--coalesce-typing", action="store_true",
+                        help="Agrupa teclas consecutivas no mesmo controle em um evento 'typing'")
+    parser.add_argument("--typing-idle", type=float, default=2.0,
+                        help="Pausa (s) sem teclas que encerra uma rajada de digitação")
+    parser.add_argument("--spool-dir", type=str, default=os.path.join(DATA_DIR, "aw_uia_spool"),
+                        help="Pasta do spool em disco para eventos não enviados ao aw-server")
+    parser.add_argument("--no-spool", action="store_true",
+                        help="Desativa o spool em disco (eventos não enviados são descartados)")
+    parser.add_argument("--batch-min", type=int, default=20,
+                        help="Tamanho mínimo do lote alvo enviado ao aw-server")
+    parser.add_argument("--batch-max", type=int, default=1000,
+                        help="Tamanho máximo do lote enviado ao aw-server")
+    parser.add_argument("--flush-interval", type=float, default=1.0,
+                        help="Espera máxima (s) de um evento no lote antes do envio")
+    parser.add_argument("--heartbeat-pulsetime", type=float, default=0.0,
+                        help="Envia via API de heartbeat: eventos consecutivos de mesmo contexto "
+                             "até N s de distância viram um só evento com duração (0 = desligado). "
+                             "Caminho do controle vai em todo evento; contagens de --coalesce-typing "
+                             "e 'repeat' de --dedup-ms não são enviadas")
+    parser.add_argument("--backend", choices=["uia", "replay"], default="uia",
+                        help="Fonte de input/contexto: uia (captura real) ou replay (gravação/sintético)")
+    parser.add_argument("--record", type=str, default=None,
+                        help="Grava os inputs resolvidos (JSONL) para replay posterior")
+    parser.add_argument("--replay-file", type=str, default=None,
+                        help="Gravação JSONL a reproduzir no backend replay (padrão: stream sintético)")
+    parser.add_argument("--replay-events", type=int, default=10000,
+                        help="Quantidade de inputs do stream sintético")
+    parser.add_argument("--replay-rate", type=float, default=0.0,
+                        help="Inputs/s no replay (0 = tempos da gravação ou velocidade máxima)")
+    parser.add_argument("--replay-uia-ms", type=float, default=0.0,
+                        help="Custo simulado (ms) de cada leitura de contexto no replay")
+    parser.add_argument("--standin", action="store_true",
+                        help="Sobe um aw-server substituto em memória e publica nele")
+    parser.add_argument("--standin-delay-ms", type=float, default=0.0,
+                        help="Latência simulada (ms) de cada insert no aw-server substituto")
+    parser.add_argument("--stats-sink", choices=["bucket", "file", "off"], default="bucket",
+                        help="Destino das estatísticas do watcher: bucket aw-uia-stats_<HOST>, arquivo ou desligado")
+    parser.add_argument("--stats-file", type=str, default=os.path.join(DATA_DIR, "aw_uia_stats.jsonl"),
+                        help="Arquivo JSONL usado com --stats-sink file")
+    parser.add_argument("--stats-interval", type=float, default=60.0,
+                        help="Intervalo (s) entre eventos de estatísticas")
+    parser.add_argument("--profile", choices=sorted(CAPTURE_PROFILES), default="standard",
+                        help="Propriedades UIA capturadas: minimal, standard (caminho só quando o controle muda) ou full")
+    parser.add_argument("--dedup-ms", type=float, default=0.0,
+                        help="Janela (ms) para fundir cliques/teclas idênticos em um evento com 'repeat' (0 desativa)")
+    parser.add_argument("--rate-limit", type=str, default="",
+                        help="Eventos/s por processo, separado por ; (ex: EXCEL.EXE=20;*=50)")
+    parser.add_argument("--role", choices=["all", "capture", "publisher"], default="all",
+                        help="all: um processo; capture/publisher: layout em dois processos via memória compartilhada")
+    parser.add_argument("--shm-name", type=str, default=None,
+                        help="Nome do ring em memória compartilhada. Padrão: aw_uia_ring_<HOST>")
+    parser.add_argument("--shm-slots", type=int, default=8192,
+                        help="Quantidade de slots do ring em memória compartilhada")
+    parser.add_argument("--shm-slot-size", type=int, default=2048,
+                        help="Tamanho (bytes) de cada slot do ring")
+    parser.add_argument("--afk-timeout", type=float, default=180.0,
+                        help="Segundos sem input para considerar o usuário ausente (0 desativa)")
     args = parser.parse_args()
 
+    # terminate() no POSIX chega como SIGTERM: encerra pelo mesmo caminho do Ctrl+C.
+    # No Windows a parada limpa é pelo --stopfile.
+    signal.signal(signal.SIGTERM, _interrupt)
+    stop = StopRequest(args.stopfile)
+    stop.start()
+
     allowlist = [p.strip().lower() for p in args.allow.split(";") if p.strip()] if args.allow else []
 
     host_name = os.environ.get("COMPUTERNAME", "host").lower()
     bucket_id = args.bucket or f"aw-watcher-uia_{host_name}"
 
-    pub = AWPublisher(bucket_id=bucket_id, host=args.host, port=args.port)
+    global PROFILE
+    PROFILE = CAPTURE_PROFILES[args.profile]
+    if args.heartbeat_pulsetime and PROFILE["path"] == "changed":
+        # heartbeat só funde data idêntico: o caminho precisa estar em todo evento
+        PROFILE = {**PROFILE, "path": "always"}
+    CONTEXT_CACHE.maxsize = args.ctx_cache_size
+    CONTEXT_CACHE.ttl = args.ctx_cache_ttl
+
+    if args.backend == "replay":
+        provider = ReplayContextProvider(uia_delay=args.replay_uia_ms / 1000.0)
+    else:
+        if args.role != "publisher" and (uia is None or psutil is None):
+            raise SystemExit("uiautomation/psutil não encontrados. pip install uiautomation psutil")
+        provider = PROVIDER
+
+    standin = None
+    if args.standin:
+        standin = StandInAWServer(delay=args.standin_delay_ms / 1000.0)
+        standin.start()
+        args.host, args.port = standin.host, standin.port
+
+    def make_reporter(collect):
+        if args.stats_sink == "bucket":
+            # id fora do padrão "aw-watcher-uia" para não entrar no event log exportado
+            stats_pub = AWPublisher(bucket_id=f"aw-uia-stats_{host_name}", bucket_type="uia.stats",
+                                    host=args.host, port=args.port)
+            stats_pub.start()
+            reporter = StatsReporter(stats_pub.publish, collect, interval=args.stats_interval)
+            stop = reporter.stop
+
+            def stop_both():
+                stop()
+                stats_pub.stop()
+
+            reporter.stop = stop_both
+        elif args.stats_sink == "file":
+            stats_lock = threading.Lock()
+
+            def write_stats(event):
+                with stats_lock, open(args.stats_file, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(event, ensure_ascii=False) + "\n")
+
+            reporter = StatsReporter(write_stats, collect, interval=args.stats_interval)
+        else:
+            return None
+        reporter.start()
+        return reporter
+
+    ring = None
+    if args.role != "all":
+        ring = ShmRing(args.shm_name or f"aw_uia_ring_{host_name}", args.shm_slots, args.shm_slot_size)
+
+    if args.role == "capture":
+        pub = RingPublisher(ring)
+    else:
+        spool = None if args.no_spool else EventSpool(args.spool_dir)
+        pub = AWPublisher(bucket_id=bucket_id, host=args.host, port=args.port, spool=spool,
+                          batch_min=args.batch_min, batch_max=args.batch_max,
+                          flush_interval=args.flush_interval,
+                          heartbeat_pulsetime=args.heartbeat_pulsetime or None)
     pub.start()
 
+    if args.role == "publisher":
+        try:
+            run_ring_publisher(ring, pub, report_interval=args.stats_interval, make_reporter=make_reporter,
+                               stop=stop)
+        finally:
+            if standin is not None:
+                print(f"[uia-publisher] aw-server substituto: {standin.stats()}")
+                standin.stop()
+        return
+
     def allowed(app_name):
         if not app_name:
             return False
@@ -191,66 +2031,191 @@ def main():
             return True
         return app_name.lower() in allowlist
 
-    def now_event(data):
-        return {
-            "timestamp": datetime.now(timezone.utc).isoformat(),
-            "duration": 0,
-            "data": data,
-        }
+    typing = None
+    if args.coalesce_typing:
+        typing = TypingCoalescer(pub.publish, idle_gap=args.typing_idle)
+
+    capture = CaptureBuffer(maxlen=args.buffer_size)
+    pause = PauseState(args.pausefile)
+    pause.start()
+
+    # Ausência: os marcadores passam pelo mesmo buffer para manter a ordem
+    def afk_start(mono, wall):
+        pub.park()
+        capture.push(RawInput("afk_start", None, None, None, mono, wall))
 
+    def afk_end(mono, wall, idle_seconds):
+        pub.unpark()
+        capture.push(RawInput("afk_end", None, None, idle_seconds, mono, wall))
+
+    idle = IdleMonitor(args.afk_timeout, afk_start, afk_end)
+
+    # Callbacks do hook: apenas registram o input bruto no ring buffer
     def on_click(x, y, button, pressed):
         if not pressed:
             return
-        if os.path.exists(args.pausefile):
-            return
-        ctx = context_from_point(x, y)
-        if not ctx or not allowed(ctx.get("app")):
+        mono, wall = time.monotonic(), time.time()
+        idle.touch(mono, wall)
+        if pause.paused:
             return
-        ev = now_event({
-            "etype": "mouse_click",
-            "button": str(button),
-            **ctx,
-        })
-        pub.publish(ev)
+        capture.push(RawInput("mouse_click", x, y, str(button), mono, wall))
 
     def on_press(key):
-        if os.path.exists(args.pausefile):
-            return
-        ctx = context_from_focus()
-        if not ctx or not allowed(ctx.get("app")):
+        mono, wall = time.monotonic(), time.time()
+        idle.touch(mono, wall)
+        if pause.paused:
             return
         # Não gravamos a tecla; apenas tipo/categoria
-        etype = "key_press"
         try:
             vk = key.vk  # pode não existir em algumas plataformas
         except AttributeError:
             vk = None
         category = "control" if vk in (9, 13, 27) else "alpha"
-        ev = now_event({
-            "etype": etype,
-            "key_category": category,
-            **ctx,
-        })
-        pub.publish(ev)
+        capture.push(RawInput("key_press", None, None, category, mono, wall))
 
-    mlistener = mouse.Listener(on_click=on_click)
-    klistener = keyboard.Listener(on_press=on_press)
+    recorder = InputRecorder(args.record) if args.record else None
 
-    mlistener.start()
-    klistener.start()
+    dedup = None
+    if args.dedup_ms > 0:
+        dedup = Deduplicator(pub.publish, window=args.dedup_ms / 1000.0)
+    rate_limits = parse_rate_limits(args.rate_limit)
+    limiter = AppRateLimiter(rate_limits) if rate_limits else None
 
-    print(f"[uia-watcher] Rodando. Bucket: {bucket_id}. Allowlist: {allowlist or 'TODOS'}")
-    print("Crie o arquivo 'aw_uia.PAUSE' na pasta atual para pausar.")
+    # Resolução (threads do pool): UIA + psutil, mantendo o timestamp do hook
+    def resolve(raw):
+        if raw.kind in ("afk_start", "afk_end"):
+            # fecha rajadas/repetições pendentes antes do marcador; sem UIA
+            if typing is not None:
+                typing.flush()
+            if dedup is not None:
+                dedup.flush()
+            if raw.kind == "afk_end":
+                extra = {"afk_seconds": round(raw.detail, 1)}
+            else:
+                extra = {"afk_timeout_s": args.afk_timeout}
+            pub.publish(UIAEvent(raw.wall, raw.kind, extra=extra))
+            return
+        dkey = None
+        if dedup is not None and raw.kind == "mouse_click":
+            # clique repetido no mesmo ponto (tolerância de 4px): sem nova consulta UIA
+            dkey = (raw.kind, raw.detail, int(raw.x) // 4, int(raw.y) // 4)
+            if dedup.merge(dkey, raw):
+                return
+        if raw.kind == "mouse_click":
+            ctx = context_from_point(raw.x, raw.y, provider=provider)
+        else:
+            ctx = context_from_focus(provider=provider)
+        if not ctx or not allowed(ctx.get("app")):
+            STATS.filtered += 1
+            return
+        if limiter is not None and not limiter.allow(ctx.get("app"), raw.mono):
+            STATS.filtered += 1
+            return
+        if recorder is not None:
+            recorder.write(raw, ctx)
+        if raw.kind == "mouse_click":
+            if typing is not None:
+                typing.flush()
+        elif typing is not None:
+            typing.add(raw, ctx)
+            return
+        elif dedup is not None:
+            dkey = (raw.kind, raw.detail) + tuple(ctx.get(f) for f in TypingCoalescer.KEY_FIELDS)
+            if dedup.merge(dkey, raw):
+                return
+        event = UIAEvent(raw.wall, raw.kind, ctx, detail=sys.intern(raw.detail))
+        t0 = time.perf_counter()
+        if dedup is not None:
+            dedup.hold(dkey, raw, event)
+        else:
+            pub.publish(event)
+        STATS.record("publish", time.perf_counter() - t0)
+        STATS.record("hook_to_publish", time.monotonic() - raw.mono)
+
+    resolvers = ResolverPool(capture, resolve, workers=args.workers, scope=provider.thread_scope)
+    resolvers.start()
+
+    if args.backend == "replay":
+        records = load_recording(args.replay_file) if args.replay_file else synthetic_inputs(args.replay_events)
+        source = ReplayInputSource(records, on_click, on_press, provider=provider, rate=args.replay_rate)
+    else:
+        source = PynputInputSource(on_click, on_press)
+
+    def collect_counters():
+        pstats = pub.stats()
+        return {
+            "captured": capture.pushed,
+            "filtered": STATS.filtered,
+            "rate_limited": limiter.limited if limiter is not None else 0,
+            "published": pstats["published"],
+            "dropped": pstats["dropped"] + capture.overwritten,
+            "queue_depth": pstats["queue_depth"],
+            "batch_target": pstats["batch_target"],
+            "ctx_cache": CONTEXT_CACHE.stats(),
+            "provider": provider.name,
+            "role": args.role,
+            **({"ring": pub.stats()["ring"]} if args.role == "capture" else {}),
+        }
+
+    reporter = make_reporter(collect_counters)
+
+    t_start = time.monotonic()
+    source.start()
+
+    target = f"ring '{ring.name}'" if args.role == "capture" else f"Bucket: {bucket_id}"
+    print(f"[uia-watcher] Rodando ({provider.name}). {target}. Allowlist: {allowlist or 'TODOS'}")
+    if args.workers > 1:
+        print(f"[uia-watcher] Aviso: {args.workers} workers resolvem fora de ordem; "
+              "rajadas de digitação e repetições podem sair trocadas.")
+    if args.backend == "uia":
+        print("Crie o arquivo 'aw_uia.PAUSE' na pasta atual para pausar.")
 
     try:
-        while True:
-            time.sleep(1)
+        while not source.done.wait(2.0 if idle.afk else 0.5) and not stop.requested:
+            if typing is not None:
+                typing.flush_idle()
+            if dedup is not None:
+                dedup.flush_expired()
+            idle.check()
     except KeyboardInterrupt:
         pass
     finally:
-        mlistener.stop()
-        klistener.stop()
+        source.stop()
+        pause.stop()
+        resolvers.stop()
+        if typing is not None:
+            typing.flush()
+        if dedup is not None:
+            dedup.flush()
         pub.stop()
+        elapsed = time.monotonic() - t_start
+        if reporter is not None:
+            reporter.stop()
+        if recorder is not None:
+            recorder.close()
+        print(f"[uia-watcher] Cache de contexto: {CONTEXT_CACHE.stats()}")
+        print(f"[uia-watcher] Cache de processos: {PROC_NAMES.stats()}")
+        print(f"[uia-watcher] Publicação: {pub.stats()}")
+        if args.backend == "replay":
+            stats = pub.stats()
+            offered = source.offered or 0
+            lost = capture.overwritten + stats["dropped"]
+            report = {
+                "inputs_offered": offered,
+                "elapsed_s": round(elapsed, 3),
+                "inputs_per_s": round(offered / elapsed, 1) if elapsed else None,
+                "events_published": stats["published"],
+                "events_per_s": round(stats["published"] / elapsed, 1) if elapsed else None,
+                "capture_overwritten": capture.overwritten,
+                "drop_rate": round(lost / offered, 4) if offered else 0.0,
+                "stages_ms": STATS.summary(),
+                "insert_ms": stats["insert_ms"],
+            }
+            if standin is not None:
+                report["standin"] = standin.stats()
+            print(f"[uia-watcher] Benchmark: {json.dumps(report)}")
+        if standin is not None:
+            standin.stop()
 
 
 if __name__ == "__main__":
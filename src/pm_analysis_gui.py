@@ -46,6 +46,7 @@ else:
     # Desenvolvimento: subir um nível da pasta src para a raiz do projeto
     RESOURCE_DIR = Path(__file__).resolve().parent.parent
 
+import numpy as np
 import pandas as pd
 import pickle
 import hashlib
@@ -181,10 +182,39 @@ def _check_graphviz():
         )
 
 
+def _read_event_table(path: str) -> pd.DataFrame:
+    """
+    Lê o event log exportado pelo gravador, em CSV ou Parquet (.parquet).
+    No Parquet o 'time:timestamp' já vem tipado (UTC) e as colunas com
+    dicionário voltam como texto comum, como no CSV.
+    """
+    if str(path).lower().endswith(".parquet"):
+        try:
+            df = pd.read_parquet(path)
+        except ImportError as e:
+            raise RuntimeError(
+                "Leitura de Parquet requer 'pyarrow'. Instale com: pip install pyarrow"
+            ) from e
+        for col in df.columns:
+            if isinstance(df[col].dtype, pd.CategoricalDtype):
+                df[col] = df[col].astype(object)
+        return df
+    return pd.read_csv(path)
+
+
 def _ensure_duration(df: pd.DataFrame) -> pd.DataFrame:
     """
-    Garante coluna 'duration' em segundos, calculada por diferença de timestamps
-    dentro de cada caso.
+    Garante coluna 'duration' em segundos, sem sobreposição entre fontes:
+    cada linha dura até o próximo evento do caso (de qualquer fonte), de modo
+    que a soma nunca passa do tempo de relógio da sessão. Quando o export traz
+    'aw:duration' (janela/input/heartbeats), ela limita a linha: um evento de
+    janela que termina antes do próximo evento não conta o intervalo ocioso
+    depois dele. A última linha do caso vai até o maior fim AW do caso, com
+    cada fim cortado no próximo evento da mesma fonte e no próximo afk_start.
+    Eventos dentro de um intervalo AFK (afk_start até afk_end) ficam com
+    duração zero. Linhas que compactam repetições ('aw:run_end', export com
+    "Compactar repetições") duram no mínimo do início ao último evento da
+    sequência.
     """
     df = df.copy()
     ts_col = "time:timestamp"
@@ -198,19 +228,111 @@ def _ensure_duration(df: pd.DataFrame) -> pd.DataFrame:
     df[ts_col] = pd.to_datetime(df[ts_col], utc=True, errors="coerce")
     df = df.dropna(subset=[ts_col])
 
-    df = df.sort_values(by=["case:concept:name", ts_col])
+    # O export já sai em ordem de horário, com cada caso contíguo; só
+    # reordena arquivos fora dessa ordem
+    codes = pd.factorize(df["case:concept:name"])[0]
+    if not (df[ts_col].is_monotonic_increasing and (np.diff(codes) >= 0).all()):
+        df = df.sort_values(by=["case:concept:name", ts_col], kind="stable")
+        codes = pd.factorize(df["case:concept:name"])[0]
+
+    # Tudo em arrays: casos são blocos contíguos, então "próxima linha do
+    # caso" é a próxima linha quando o código do caso não muda
+    t = (df[ts_col] - df[ts_col].min()).dt.total_seconds().to_numpy()
+    n = len(t)
+    same = np.zeros(n, dtype=bool)
+    same[:-1] = codes[1:] == codes[:-1]
+    last = ~same
+    gap = np.full(n, np.nan)
+    gap[:-1] = t[1:] - t[:-1]
+    gap[last] = np.nan
+
+    duration = gap
+    if "aw:duration" in df.columns:
+        own = pd.to_numeric(df["aw:duration"], errors="coerce").to_numpy(dtype=float)
+        own = np.where(own > 0, own, np.nan)
+        # eventos com duração AW: no máximo até o próximo evento do caso
+        duration = np.fmin(gap, own)
+        # última linha do caso: maior fim AW do caso que passa dela. Só
+        # contam eventos sem afk_start depois e últimos da sua fonte no caso
+        # (os demais são cortados antes da última linha)
+        end = t + own
+        cand = end > t[last][codes]
+        if cand.any() and "aw:etype" in df.columns:
+            is_afk = (df["aw:etype"] == "afk_start").to_numpy()
+            last_afk = np.full(codes.max() + 1, -np.inf)
+            np.maximum.at(last_afk, codes[is_afk], t[is_afk])
+            cand &= last_afk[codes] < t
+        if cand.any() and "aw:source" in df.columns:
+            src = pd.factorize(df["aw:source"])[0] + 1
+            later = pd.Series(codes * (src.max() + 1) + src).duplicated(keep="last").to_numpy()
+            cand &= ~later
+        tail_end = np.full(codes.max() + 1 if n else 0, -np.inf)
+        np.maximum.at(tail_end, codes[cand], end[cand])
+        duration[last] = tail_end - t[last]
+    duration = np.nan_to_num(duration, nan=0.0, neginf=0.0).clip(min=0)
+
+    if "aw:run_end" in df.columns:
+        run_end = pd.to_datetime(df["aw:run_end"], utc=True, errors="coerce")
+        span = (run_end - df[ts_col]).dt.total_seconds().fillna(0).to_numpy()
+        duration = np.maximum(duration, span)
+
+    # Intervalos de ausência marcados pelo watcher (afk_start → afk_end)
+    # não contam como tempo de atividade
+    if "aw:etype" in df.columns:
+        etype = df["aw:etype"]
+        marks = np.full(n, np.nan)
+        marks[(etype == "afk_end").to_numpy()] = 0.0
+        marks[(etype == "afk_start").to_numpy()] = 1.0
+        first = np.ones(n, dtype=bool)
+        first[1:] = last[:-1]
+        marks[first & np.isnan(marks)] = 0.0  # não herda do caso anterior
+        duration[pd.Series(marks).ffill().to_numpy() == 1.0] = 0.0
+
+    df["duration"] = duration
+    return df
 
-    df["__next_ts"] = df.groupby("case:concept:name")[ts_col].shift(-1)
-    df["duration"] = (df["__next_ts"] - df[ts_col]).dt.total_seconds()
-    df["duration"] = df["duration"].fillna(0).clip(lower=0)
-    df = df.drop(columns=["__next_ts"])
 
-    return df
+def _case_seconds(df: pd.DataFrame) -> pd.Series:
+    """
+    Duração (s) de cada caso: do primeiro timestamp ao fim do último evento.
+    Com a coluna 'duration' (já cortada por _ensure_duration) o fim é
+    timestamp + duration; senão o último timestamp. O 'aw:end_timestamp' bruto
+    não entra: ele sobrepõe fontes e atravessa intervalos AFK.
+    """
+    ts = pd.to_datetime(df["time:timestamp"], utc=True, errors="coerce")
+    end = ts
+    if "duration" in df.columns:
+        end = ts + pd.to_timedelta(df["duration"].fillna(0), unit="s")
+    case = df["case:concept:name"]
+    return (end.groupby(case).max() - ts.groupby(case).min()).dt.total_seconds()
+
+
+def _event_counts(df: pd.DataFrame) -> pd.Series:
+    """Eventos representados por linha: 'aw:repeat' (repetições compactadas) ou 1."""
+    if "aw:repeat" in df.columns:
+        return pd.to_numeric(df["aw:repeat"], errors="coerce").fillna(1).astype(int)
+    return pd.Series(1, index=df.index)
+
+
+# Marcadores de ausência do watcher: entram no cálculo de duração
+# (_ensure_duration), mas não são atividades do processo.
+MARKER_ETYPES = ("afk_start", "afk_end")
+
+
+def _drop_markers(df: pd.DataFrame) -> pd.DataFrame:
+    """Remove as linhas de marcador (MARKER_ETYPES) antes de minerar/contar atividades."""
+    if "aw:etype" not in df.columns:
+        return df
+    return df[~df["aw:etype"].isin(MARKER_ETYPES)].copy()
 
 
 def _csv_to_eventlog(csv_path: str):
-    """Lê o CSV exportado pelo gravador e converte em event log do pm4py."""
-    df = pd.read_csv(csv_path)
+    """
+    Lê o CSV exportado pelo gravador e converte em event log do pm4py.
+    O event log sai sem os marcadores AFK; o DataFrame devolvido os mantém
+    (para o cálculo de duração).
+    """
+    df = _read_event_table(csv_path)
 
     required = ["case:concept:name", "concept:name", "time:timestamp"]
     missing = [c for c in required if c not in df.columns]
@@ -233,7 +355,7 @@ def _csv_to_eventlog(csv_path: str):
     }
 
     event_log = log_converter.apply(
-        df_pm,
+        _drop_markers(df_pm),
         variant=log_converter.Variants.TO_EVENT_LOG,
         parameters=parameters,
     )
@@ -254,8 +376,8 @@ def _csv_to_eventlog(csv_path: str):
 
 def compute_kpis(csv_path: str):
     """Gera KPIs do processo, top atividades e resumo por tipo de app."""
-    df = pd.read_csv(csv_path)
-    df = _ensure_duration(df)
+    df = _read_event_table(csv_path)
+    df = _drop_markers(_ensure_duration(df))
 
     # Classificação por tipo de app (Business / Pessoal / Outros)
     # Tornar coluna 'app' opcional
@@ -270,8 +392,9 @@ def compute_kpis(csv_path: str):
     total_minutes_obs = total_seconds_obs / 60.0
     total_hours_obs = total_minutes_obs / 60.0
 
-    # Eventos e casos
-    num_events = len(df)
+    # Eventos e casos (linhas compactadas contam suas repetições)
+    df["__n"] = _event_counts(df)
+    num_events = int(df["__n"].sum())
     num_cases = df["case:concept:name"].nunique() if "case:concept:name" in df.columns else 1
 
     if "concept:name" not in df.columns:
@@ -279,7 +402,7 @@ def compute_kpis(csv_path: str):
 
     # Top atividades por tempo acumulado
     grouped = df.groupby("concept:name", as_index=False).agg(
-        num_eventos=("concept:name", "count"),
+        num_eventos=("__n", "sum"),
         tempo_total_segundos=("duration", "sum"),
     )
     grouped["tempo_total_min"] = grouped["tempo_total_segundos"] / 60.0
@@ -289,11 +412,7 @@ def compute_kpis(csv_path: str):
     avg_case_seconds = None
     total_case_seconds = None
     if "case:concept:name" in df.columns and "time:timestamp" in df.columns:
-        df_sorted = df.sort_values(["case:concept:name", "time:timestamp"])
-        grp_ts = df_sorted.groupby("case:concept:name")["time:timestamp"]
-        start = grp_ts.min()
-        end = grp_ts.max()
-        case_durations = (end - start).dt.total_seconds()
+        case_durations = _case_seconds(df)
         if len(case_durations) > 0:
             avg_case_seconds = float(case_durations.mean())
             total_case_seconds = float(case_durations.sum())
@@ -348,7 +467,7 @@ def compute_kpis(csv_path: str):
     
     cat_group = df.groupby("app_category", as_index=False).agg(
         tempo_total_segundos=("duration", "sum"),
-        num_eventos=("app", "count"),
+        num_eventos=("__n", "sum"),
         num_apps=("app", "nunique"),
     )
     if total_seconds_obs > 0:
@@ -456,7 +575,7 @@ def compute_variants(csv_path: str):
 
 def compute_top_variants(csv_path: str, top_n: int = 10):
     """Calcula Top-N variantes do processo e salva em TXT + CSV para tabela."""
-    df = pd.read_csv(csv_path)
+    df = _read_event_table(csv_path)
 
     required = ["case:concept:name", "concept:name", "time:timestamp"]
     missing = [c for c in required if c not in df.columns]
@@ -468,7 +587,7 @@ def compute_top_variants(csv_path: str, top_n: int = 10):
         )
 
     df["time:timestamp"] = pd.to_datetime(df["time:timestamp"], utc=True, errors="coerce")
-    df = df.dropna(subset=["time:timestamp"])
+    df = _drop_markers(df.dropna(subset=["time:timestamp"]))
     df = df.sort_values(by=["case:concept:name", "time:timestamp"])
 
     sequences = df.groupby("case:concept:name")["concept:name"].apply(tuple)
@@ -611,7 +730,7 @@ def compute_timeline_by_hour(csv_path: str):
     usando 'time:timestamp' e 'duration'.
     Retorna (lista_horas, lista_valores_em_horas).
     """
-    df = pd.read_csv(csv_path)
+    df = _read_event_table(csv_path)
     df = _ensure_duration(df)
 
     if "time:timestamp" not in df.columns:
@@ -639,21 +758,17 @@ def compute_timeline_by_hour(csv_path: str):
 
 def compute_kpis_metrics_from_df(df: pd.DataFrame) -> dict:
     """Versão enxuta do compute_kpis que devolve apenas um dict de métricas."""
-    df = _ensure_duration(df)
+    df = _drop_markers(_ensure_duration(df))
 
     metrics = {}
 
-    metrics["num_events"] = len(df)
+    metrics["num_events"] = int(_event_counts(df).sum())
     metrics["num_cases"] = df["case:concept:name"].nunique() if "case:concept:name" in df.columns else 1
 
     avg_case_seconds = None
     total_case_seconds = None
     if "case:concept:name" in df.columns and "time:timestamp" in df.columns:
-        df_sorted = df.sort_values(["case:concept:name", "time:timestamp"])
-        grp_ts = df_sorted.groupby("case:concept:name")["time:timestamp"]
-        start = grp_ts.min()
-        end = grp_ts.max()
-        case_durations = (end - start).dt.total_seconds()
+        case_durations = _case_seconds(df)
         if len(case_durations) > 0:
             avg_case_seconds = float(case_durations.mean())
             total_case_seconds = float(case_durations.sum())
@@ -1670,8 +1785,13 @@ class AnalysisApp(tk.Tk):
 
     def _on_browse(self):
         path = filedialog.askopenfilename(
-            title="Selecione o CSV de log",
-            filetypes=[("CSV files", "*.csv"), ("All files", "*.*")],
+            title="Selecione o event log (CSV ou Parquet)",
+            filetypes=[
+                ("Event logs", "*.csv *.parquet"),
+                ("CSV files", "*.csv"),
+                ("Parquet files", "*.parquet"),
+                ("All files", "*.*"),
+            ],
         )
         if path:
             self.csv_path_var.set(path)
@@ -6,7 +6,7 @@ SENAI TASK MINING - Gravador e exportador
 GUI simples para:
 - Iniciar/parar o aw_watcher_uia.py
 - Exportar os eventos da sessão (window + input + uia) para CSV
-  compatível com o pm_analysis_gui.py (colunas:
+  (ou Parquet, com pyarrow) compatível com o pm_analysis_gui.py (colunas:
   case:concept:name, concept:name, time:timestamp, ...)
 
 Pré-requisitos no .venv:
@@ -18,9 +18,15 @@ O ActivityWatch (aw-server) precisa estar rodando.
 import sys
 import os
 import csv
+import heapq
+import json
 import logging
+import re
+import socket
 import subprocess
 import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone, timedelta
 from pathlib import Path
 
@@ -32,6 +38,12 @@ try:
 except ImportError:
     ActivityWatchClient = None
 
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
 # ---------------------------------------------------------------------
 # Caminhos básicos
 # ---------------------------------------------------------------------
@@ -54,15 +66,61 @@ OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
 
 LOG_PATH = DATA_DIR / 'pm_workbench_gui.log'
 
+# Exportação incremental: checkpoint por bucket + log contínuo (append)
+CHECKPOINT_PATH = DATA_DIR / 'export_checkpoint.json'
+ROLLING_DIR = OUTPUT_DIR / 'rolling'
+EXPORT_LAG = timedelta(seconds=10)  # margem para eventos ainda no lote do watcher
+# Releitura a cada exportação parcial: o watcher grava eventos com horário
+# anterior ao envio (afk_start até --afk-timeout depois, rajadas de
+# digitação, repetições do dedup, reenvio do spool). Cobre o --afk-timeout
+# padrão (180 s); eventos reenviados depois de uma queda mais longa do
+# aw-server só entram na exportação da sessão.
+EXPORT_OVERLAP = timedelta(minutes=5)
+
+# Regras opcionais de normalização dos rótulos de atividade (ver LabelNormalizer)
+LABEL_RULES_PATH = DATA_DIR / 'label_rules.json'
+
 # Ajuste este caminho se mudar a pasta do watcher
 AW_UIA_DIR = RESOURCE_DIR  # modo frozen usa o próprio EXE para rodar o watcher
 AW_UIA_SCRIPT = AW_UIA_DIR / "aw_watcher_uia.py"
 
-def _watcher_cmd():
+# Papéis do watcher: "all" (um processo) ou captura + envio em processos
+# separados, ligados por um ring em memória compartilhada.
+WATCHER_ROLES_SINGLE = ("all",)
+WATCHER_ROLES_SPLIT = ("publisher", "capture")  # ordem de início
+
+# aw-server usado pelo watcher e pela exportação (ex.: PM_AW_PORT=5666 para
+# testar contra um "aw-server --testing")
+AW_HOST = os.environ.get("PM_AW_HOST", "127.0.0.1")
+AW_PORT = int(os.environ.get("PM_AW_PORT", "5600"))
+
+# Intervalo (ms) entre verificações dos processos do watcher
+SUPERVISE_MS = 2000
+# Reinício de um papel que morreu: espera dobra a cada falha seguida (até
+# RESTART_BACKOFF_MAX s); após WATCHER_MAX_RESTARTS falhas desiste. Um
+# processo que fica WATCHER_STABLE_S s no ar zera a contagem.
+RESTART_BACKOFF_MAX = 60.0
+WATCHER_MAX_RESTARTS = 5
+WATCHER_STABLE_S = 30.0
+# Espera (s) pela saída limpa do watcher (arquivo de parada) antes do terminate()
+WATCHER_STOP_TIMEOUT = 15
+
+
+def _stop_file(role="all"):
+    """Arquivo sentinela que pede a parada limpa de um papel do watcher."""
+    return DATA_DIR / f"aw_uia_{role}.STOP"
+
+
+def _watcher_cmd(role="all"):
     """No executável, o watcher roda chamando o próprio EXE com --uia-watcher."""
     if getattr(sys, 'frozen', False):
-        return [sys.executable, '--uia-watcher']
-    return [sys.executable, str(AW_UIA_SCRIPT)]
+        cmd = [sys.executable, '--uia-watcher']
+    else:
+        cmd = [sys.executable, str(AW_UIA_SCRIPT)]
+    if role != "all":
+        cmd += ["--role", role]
+    cmd += ["--host", AW_HOST, "--port", str(AW_PORT), "--stopfile", str(_stop_file(role))]
+    return cmd
 
 logger = logging.getLogger("pm_workbench_gui")
 
@@ -81,119 +139,903 @@ def setup_logging():
 # ---------------------------------------------------------------------
 # Lógica de exportação ActivityWatch → CSV
 # ---------------------------------------------------------------------
-def _collect_events_between(start_utc, end_utc):
+STATS_BUCKET_TYPE = "uia.stats"  # estatísticas do watcher, não são eventos de processo
+FETCH_WORKERS = 4  # buckets lidos em paralelo na exportação
+EXPORT_SLICE = timedelta(minutes=30)  # fatia de tempo lida por vez na exportação
+
+_fetch_local = threading.local()
+
+
+def _thread_client():
+    """Um ActivityWatchClient por thread de leitura (reaproveitado entre buckets)."""
+    client = getattr(_fetch_local, "client", None)
+    if client is None:
+        client = ActivityWatchClient("senai-taskmining-export", host=AW_HOST, port=AW_PORT)
+        _fetch_local.client = client
+    return client
+
+
+def _event_ts(item):
+    return item[0] or datetime.min.replace(tzinfo=timezone.utc)
+
+
+def _parse_ts(value):
+    if isinstance(value, datetime) or value is None:
+        return value
+    return datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+
+
+def _bucket_query(bid, label, apps=None, focus_bid=None):
+    """
+    Consulta (linguagem de query do aw-server) que devolve um bucket já
+    filtrado e fundido no servidor:
+    - window/uia: só as apps de ``apps`` (quando informado);
+    - input: só os períodos em que uma app de ``apps`` estava em foco
+      (interseção com o bucket de janela ``focus_bid``);
+    - window/input: ``flood`` funde eventos vizinhos iguais e fecha lacunas.
+    """
+    lines = [f"events = query_bucket({json.dumps(bid)});"]
+    if apps:
+        if label != "input":
+            lines.append(f'events = filter_keyvals(events, "app", {json.dumps(apps)});')
+        elif focus_bid:
+            lines.append(f"focus = query_bucket({json.dumps(focus_bid)});")
+            lines.append(f'focus = filter_keyvals(focus, "app", {json.dumps(apps)});')
+            lines.append("events = filter_period_intersect(events, focus);")
+    if label != "uia":
+        lines.append("events = flood(events);")
+    lines.append("RETURN = sort_by_timestamp(events);")
+    return "\n".join(lines)
+
+
+def _restore_trimmed(client, items, start_utc, end_utc):
     """
-    Coleta eventos dos buckets aw-watcher-window / aw-watcher-input / aw-watcher-uia
-    entre start_utc e end_utc usando aw_client.
-    Retorna lista de tuplas (timestamp, data_dict, source_label, bucket_id).
+    Devolve início e duração completos aos eventos que tocam as bordas da
+    janela lida. O aw-server-rust corta os eventos no intervalo pedido; o
+    evento gravado, lido pelo id, tem o horário e a duração originais (um
+    evento de janela de 2 h não sai com só 30 min, o tamanho da fatia).
+    """
+    out = []
+    for it in items:
+        ts, data, label, bid, dur, event_id = it
+        if event_id is not None and ts is not None and (
+            ts <= start_utc or ts + timedelta(seconds=dur) >= end_utc
+        ):
+            stored = client.get_event(bid, event_id)
+            if stored is not None:
+                s_ts = _parse_ts(stored.get("timestamp"))
+                s_dur = stored.get("duration")
+                s_dur = s_dur.total_seconds() if isinstance(s_dur, timedelta) else float(s_dur or 0)
+                begin = min(ts, s_ts)
+                finish = max(ts + timedelta(seconds=dur), s_ts + timedelta(seconds=s_dur))
+                it = (begin, data, label, bid, (finish - begin).total_seconds(), event_id)
+        out.append(it)
+    return out
+
+
+def _fetch_bucket_query(bid, label, start_utc, end_utc, query):
+    """
+    Como _fetch_bucket, mas via API de query (``query`` de _bucket_query).
+    Eventos de input ficam cortados no intervalo: a interseção com o foco
+    já define o período deles.
+    """
+    t0 = time.perf_counter()
+    client = _thread_client()
+    result = client.query(query, [(start_utc, end_utc)])
+    items = []
+    for ev in (result[0] if result else []):
+        items.append(
+            (_parse_ts(ev.get("timestamp")), ev.get("data", {}) or {}, label, bid,
+             float(ev.get("duration") or 0), ev.get("id"))
+        )
+    if label != "input":
+        items = _restore_trimmed(client, items, start_utc, end_utc)
+    items.sort(key=_event_ts)
+    return items, time.perf_counter() - t0
+
+
+def _export_targets(buckets, host=None):
+    """
+    (bucket_id, rótulo) dos buckets window/input/uia deste computador.
+    Buckets de outros hosts (aw-server compartilhado) ficam de fora; buckets
+    sem 'hostname' nos metadados são mantidos. Buckets de estatísticas do
+    watcher (tipo "uia.stats", inclusive o antigo aw-watcher-uia-stats_<host>)
+    nunca entram no event log.
+    """
+    host = host or socket.gethostname()
+    targets = []
+    for label in ("window", "input", "uia"):
+        for bid, meta in buckets.items():
+            if f"aw-watcher-{label}" not in bid:
+                continue
+            if (meta or {}).get("type") == STATS_BUCKET_TYPE or "-stats" in bid:
+                continue
+            hostname = (meta or {}).get("hostname")
+            if hostname and hostname != host:
+                continue
+            targets.append((bid, label))
+    return targets
+
+
+def _fetch_bucket(bid, label, start_utc, end_utc):
+    """
+    Lê um bucket na janela e devolve (eventos ordenados por horário, segundos).
+    Cada evento vira (timestamp, data_dict, source_label, bucket_id, duração_s, id).
+    Eventos que atravessam as bordas saem inteiros (ver _restore_trimmed).
+    """
+    t0 = time.perf_counter()
+    client = _thread_client()
+    evs = client.get_events(bid, start=start_utc, end=end_utc)
+    items = []
+    for ev in evs:
+        # ev pode ser dict ou um objeto Event
+        if isinstance(ev, dict):
+            ts = ev.get("timestamp")
+            data = ev.get("data", {}) or {}
+            dur = ev.get("duration")
+            event_id = ev.get("id")
+        else:
+            ts = getattr(ev, "timestamp", None)
+            data = getattr(ev, "data", {}) or {}
+            dur = getattr(ev, "duration", None)
+            event_id = getattr(ev, "id", None)
+        dur = dur.total_seconds() if isinstance(dur, timedelta) else float(dur or 0)
+        items.append((ts, data, label, bid, dur, event_id))
+    items = _restore_trimmed(client, items, start_utc, end_utc)
+    # o aw-server devolve do mais recente para o mais antigo
+    items.sort(key=_event_ts)
+    return items, time.perf_counter() - t0
+
+
+def _new_in_slice(item, prev_ids, sl_start):
+    """
+    Item ainda não exportado na fatia anterior: id fora de ``prev_ids`` ou,
+    sem id, começa a partir de ``sl_start``.
+    """
+    if item[5] is not None:
+        return item[5] not in prev_ids
+    return item[0] is not None and item[0] >= sl_start
+
+
+def _iter_events_between(start_utc, end_utc, log=None, slice_len=None, bucket_start=None,
+                         use_query=False, apps=None, host=None, strict=False):
+    """
+    Gera, em ordem de horário, os eventos dos buckets aw-watcher-window /
+    aw-watcher-input / aw-watcher-uia entre start_utc e end_utc.
+
+    A janela é lida em fatias de ``slice_len``; em cada fatia os buckets são
+    lidos em paralelo e as listas (já ordenadas) intercaladas. A próxima fatia
+    é buscada enquanto a atual é consumida, então só ~2 fatias ficam em memória.
+    Eventos que atravessam a borda entre fatias saem uma vez, com início e
+    duração completos: o aw-server devolve o evento nas duas fatias (o
+    aw-server-rust ainda o corta no intervalo pedido, ver _restore_trimmed),
+    e o ``id`` já visto na fatia anterior do bucket é descartado. Sem ``id``
+    vale o horário: só conta na fatia onde começa.
+    ``bucket_start`` (bucket_id -> datetime) lê cada bucket só a partir
+    daquele instante (checkpoint da exportação incremental).
+    Só entram buckets de ``host`` (padrão: este computador). Com
+    ``use_query`` a leitura usa a API de query do aw-server, filtrando por
+    ``apps`` e fundindo eventos no servidor (ver _bucket_query).
+    Tempo e quantidade por bucket vão para ``log`` (padrão: logger).
+    Falha ao ler um bucket só gera aviso; com ``strict`` a exceção sobe antes
+    de a fatia ser entregue (exportação incremental: o checkpoint não pode
+    passar de uma fatia que não foi lida).
+    Cada item é uma tupla (timestamp, data_dict, source_label, bucket_id, duração_s, id).
     """
     if ActivityWatchClient is None:
         raise RuntimeError(
             "Biblioteca 'aw_client' não encontrada no .venv.\n"
             "Instale com: pip install aw-client"
         )
+    log = log or logger.info
+    slice_len = slice_len or EXPORT_SLICE
+    bucket_start = bucket_start or {}
 
-    client = ActivityWatchClient("senai-taskmining-export")
+    client = ActivityWatchClient("senai-taskmining-export", host=AW_HOST, port=AW_PORT)
     client.connect()
 
     buckets = client.get_buckets()  # dict: bucket_id -> metadata
-    window_ids = [bid for bid in buckets.keys() if "aw-watcher-window" in bid]
-    input_ids = [bid for bid in buckets.keys() if "aw-watcher-input" in bid]
-    uia_ids = [bid for bid in buckets.keys() if "aw-watcher-uia" in bid]
+    targets = _export_targets(buckets, host)
+    if not targets:
+        return
+
+    if use_query:
+        focus_bid = next((bid for bid, label in targets if label == "window"), None)
+        queries = {bid: _bucket_query(bid, label, apps, focus_bid) for bid, label in targets}
+
+        def fetch(bid, label, sl_start, sl_end):
+            return _fetch_bucket_query(bid, label, sl_start, sl_end, queries[bid])
+    else:
+        fetch = _fetch_bucket
+
+    slices = []
+    s = start_utc
+    while s < end_utc:
+        slices.append((s, min(end_utc, s + slice_len)))
+        s += slice_len
+
+    counts = {bid: 0 for bid, _ in targets}
+    elapsed = {bid: 0.0 for bid, _ in targets}
+    seen = {bid: set() for bid, _ in targets}  # ids da fatia anterior
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, min(FETCH_WORKERS, len(targets)))) as pool:
+
+        def submit(sl_start, sl_end):
+            futures = []
+            for bid, label in targets:
+                since = bucket_start.get(bid)
+                if since is not None and since >= sl_end:
+                    continue  # fatia inteira já exportada para este bucket
+                fetch_start = max(sl_start, since) if since is not None else sl_start
+                futures.append((bid, pool.submit(fetch, bid, label, fetch_start, sl_end)))
+            return futures
+
+        pending = submit(*slices[0]) if slices else []
+        for i, (sl_start, sl_end) in enumerate(slices):
+            futures = pending
+            pending = submit(*slices[i + 1]) if i + 1 < len(slices) else []
+            streams = []
+            for bid, fut in futures:
+                try:
+                    items, secs = fut.result()
+                except Exception as e:
+                    if strict:
+                        raise
+                    logger.warning("Falha ao ler bucket %s: %s", bid, e)
+                    continue
+                prev, seen[bid] = seen[bid], {it[5] for it in items if it[5] is not None}
+                if i > 0:
+                    items = [it for it in items if _new_in_slice(it, prev, sl_start)]
+                counts[bid] += len(items)
+                elapsed[bid] += secs
+                streams.append(items)
+            yield from heapq.merge(*streams, key=_event_ts)
+
+    for bid, _ in targets:
+        log(f"Bucket {bid}: {counts[bid]} eventos em {elapsed[bid]:.2f}s")
+    log(f"Leitura dos buckets: {time.perf_counter() - t0:.2f}s ({len(slices)} fatias)")
+
+
+def _collect_events_between(start_utc, end_utc, log=None):
+    """
+    Igual a _iter_events_between, mas devolve a lista completa.
+    Lança RuntimeError se não houver eventos.
+    """
+    all_events = list(_iter_events_between(start_utc, end_utc, log=log))
+    if not all_events:
+        raise RuntimeError("Janela sem eventos (curta demais?).")
+    return all_events
 
-    all_events = []
 
-    def _grab(bid_list, label):
-        nonlocal all_events
-        for bid in bid_list:
-            try:
-                evs = client.get_events(bid, start=start_utc, end=end_utc)
-                for ev in evs:
-                    # ev pode ser dict ou um objeto Event
-                    if isinstance(ev, dict):
-                        ts = ev.get("timestamp")
-                        data = ev.get("data", {}) or {}
-                    else:
-                        ts = getattr(ev, "timestamp", None)
-                        data = getattr(ev, "data", {}) or {}
-                    all_events.append((ts, data, label, bid))
-            except Exception as e:
-                logger.warning("Falha ao ler bucket %s: %s", bid, e)
+EVENT_LOG_FIELDS = [
+    "case:concept:name",
+    "concept:name",
+    "time:timestamp",
+    "aw:bucket",
+    "aw:source",
+    "aw:app",
+    "aw:title",
+    "aw:etype",
+    "aw:duration",
+    "aw:end_timestamp",
+]
 
-    _grab(window_ids, "window")
-    _grab(input_ids, "input")
-    _grab(uia_ids, "uia")
 
-    if not all_events:
-        raise RuntimeError("Janela sem eventos (curta demais?).")
+class LabelNormalizer:
+    """
+    Normaliza o rótulo 'etype | app | título' para reduzir a cardinalidade de
+    concept:name (nomes de documento, ids, horários no título da janela).
+
+    Regras (JSON, ver LABEL_RULES_PATH), aplicadas nesta ordem ao título:
+    - "app_titles": {app: [{"pattern", "template"}]} — o primeiro padrão da
+      app que casar troca o título por ``template`` (aceita \\1, \\g<nome>);
+    - "title_rewrites": [{"pattern", "replace"}] — re.sub em todo título;
+    - "max_title_len": trunca o título;
+    e por fim "label_rewrites" ([{"pattern", "replace"}]) no rótulo montado.
+    Os padrões são compilados uma vez e o resultado é memorizado por
+    (etype, app, título) bruto.
+    """
 
-    # Ordena por horário
-    all_events.sort(key=lambda x: x[0] or datetime.min.replace(tzinfo=timezone.utc))
-    return all_events
+    def __init__(self, rules: dict):
+        def compile_list(items, key):
+            return [(re.compile(r["pattern"], re.IGNORECASE), r.get(key, "")) for r in items or []]
+
+        self.app_titles = {
+            app.lower(): compile_list(items, "template")
+            for app, items in (rules.get("app_titles") or {}).items()
+        }
+        self.title_rewrites = compile_list(rules.get("title_rewrites"), "replace")
+        self.label_rewrites = compile_list(rules.get("label_rewrites"), "replace")
+        self.max_title_len = rules.get("max_title_len")
+        self._cache = {}
+
+    def label(self, etype, app, title):
+        key = (etype, app, title)
+        activity = self._cache.get(key)
+        if activity is None:
+            activity = self._cache[key] = self._normalize(etype, app, title)
+        return activity
+
+    def _normalize(self, etype, app, title):
+        for pattern, template in self.app_titles.get(app.lower(), ()):
+            m = pattern.search(title)
+            if m:
+                title = m.expand(template)
+                break
+        for pattern, replace in self.title_rewrites:
+            title = pattern.sub(replace, title)
+        title = title.strip()
+        if self.max_title_len and len(title) > self.max_title_len:
+            title = title[: self.max_title_len].rstrip() + "…"
+        activity = _activity_label(etype, app, title)
+        for pattern, replace in self.label_rewrites:
+            activity = pattern.sub(replace, activity)
+        return activity
+
+    def cardinality(self):
+        """(rótulos brutos distintos, rótulos normalizados distintos)."""
+        raw = {_activity_label(*key) for key in self._cache}
+        return len(raw), len(set(self._cache.values()))
+
+
+def load_label_normalizer(path: Path = LABEL_RULES_PATH):
+    """LabelNormalizer das regras em ``path`` (None se não houver arquivo ou for inválido)."""
+    try:
+        rules = json.loads(Path(path).read_text(encoding="utf-8"))
+        return LabelNormalizer(rules)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.warning("Regras de rótulo ignoradas (%s): %s", path, e)
+        return None
+
+
+def _activity_label(etype, app, title):
+    parts = [p for p in [etype, app, title] if p]
+    return " | ".join(parts) if parts else "EVENTO"
+
+
+def _event_to_row(event, case_id, normalizer=None):
+    """
+    Converte uma tupla de evento AW numa linha do event log (ou None).
+    'time:timestamp'/'aw:end_timestamp' ficam como datetime UTC; cada writer
+    serializa do seu jeito. 'aw:duration' é a duração (s) gravada no aw-server.
+    Com ``normalizer`` o concept:name sai normalizado (aw:title fica bruto).
+    """
+    ts, data, source_label, bucket_id, duration, _ = event
+    if ts is None:
+        return None
+    if not isinstance(ts, datetime):
+        try:
+            ts = datetime.fromisoformat(str(ts))
+        except Exception:
+            return None
+    ts_utc = ts.astimezone(timezone.utc)
+
+    app = data.get("app") or data.get("exe") or ""
+    title = data.get("title") or data.get("window_title") or data.get("name") or ""
+    etype = data.get("etype") or data.get("event_type") or data.get("key_category") or source_label
+
+    if normalizer is not None:
+        activity = normalizer.label(etype, app, title)
+    else:
+        activity = _activity_label(etype, app, title)
+
+    return {
+        "case:concept:name": case_id,
+        "concept:name": activity,
+        "time:timestamp": ts_utc,
+        "aw:bucket": bucket_id,
+        "aw:source": source_label,
+        "aw:app": app,
+        "aw:title": title,
+        "aw:etype": etype,
+        "aw:duration": duration,
+        "aw:end_timestamp": ts_utc + timedelta(seconds=duration),
+    }
+
+
+def _csv_row(row):
+    return {k: v.isoformat() if isinstance(v, datetime) else v for k, v in row.items()}
+
+
+class CsvEventWriter:
+    """
+    Grava linhas do event log em CSV à medida que chegam.
+    Escreve num arquivo temporário e só o renomeia para o destino em
+    ``close()``; ``discard()`` apaga o temporário (exportação sem linhas/erro).
+    """
+
+    def __init__(self, path: Path, fieldnames=EVENT_LOG_FIELDS):
+        self.path = Path(path)
+        self.tmp_path = self.path.with_name(self.path.name + ".part")
+        self._f = self.tmp_path.open("w", newline="", encoding="utf-8")
+        self._writer = csv.DictWriter(self._f, fieldnames=fieldnames)
+        self._writer.writeheader()
+        self.rows = 0
+
+    def write(self, row):
+        self._writer.writerow(_csv_row(row))
+        self.rows += 1
+
+    def close(self):
+        self._f.close()
+        os.replace(self.tmp_path, self.path)
+
+    def discard(self):
+        self._f.close()
+        self.tmp_path.unlink(missing_ok=True)
+
+
+# Colunas de texto repetitivas: gravadas com dicionário (cada valor distinto 1x)
+PARQUET_DICT_FIELDS = {
+    "case:concept:name", "concept:name", "aw:bucket", "aw:source", "aw:app", "aw:title", "aw:etype",
+}
+# Colunas não textuais (nome -> tipo)
+PARQUET_TYPED_FIELDS = {
+    "time:timestamp": "timestamp",
+    "aw:end_timestamp": "timestamp",
+    "aw:duration": "float64",
+    "aw:run_end": "timestamp",
+    "aw:repeat": "int64",
+}
+
+
+class ParquetEventWriter:
+    """
+    Mesma interface do CsvEventWriter, gravando Parquet (requer pyarrow).
+    'time:timestamp' vira timestamp UTC tipado e as colunas de texto
+    repetitivas são codificadas com dicionário. As linhas são acumuladas em
+    colunas e gravadas a cada ``row_group`` linhas (memória limitada).
+    """
+
+    def __init__(self, path: Path, fieldnames=EVENT_LOG_FIELDS, row_group=50_000):
+        if pq is None:
+            raise RuntimeError("Biblioteca 'pyarrow' não encontrada. Instale com: pip install pyarrow")
+        self.path = Path(path)
+        self.tmp_path = self.path.with_name(self.path.name + ".part")
+        self.fieldnames = list(fieldnames)
+        self.row_group = row_group
+        types = {"timestamp": pa.timestamp("us", tz="UTC"), "int64": pa.int64(), "float64": pa.float64()}
+        self.schema = pa.schema([
+            (
+                name,
+                types[PARQUET_TYPED_FIELDS[name]] if name in PARQUET_TYPED_FIELDS
+                else pa.dictionary(pa.int32(), pa.string()) if name in PARQUET_DICT_FIELDS
+                else pa.string(),
+            )
+            for name in self.fieldnames
+        ])
+        self._writer = pq.ParquetWriter(str(self.tmp_path), self.schema, compression="zstd")
+        self._cols = {name: [] for name in self.fieldnames}
+        self.rows = 0
+
+    def write(self, row):
+        for name, col in self._cols.items():
+            col.append(row.get(name))
+        self.rows += 1
+        if len(self._cols["time:timestamp"]) >= self.row_group:
+            self._flush()
+
+    def _flush(self):
+        if not self._cols["time:timestamp"]:
+            return
+        arrays = []
+        for field in self.schema:
+            values = self._cols[field.name]
+            if pa.types.is_dictionary(field.type):
+                arrays.append(pa.array(values, type=pa.string()).dictionary_encode())
+            else:
+                arrays.append(pa.array(values, type=field.type))
+        self._writer.write_table(pa.Table.from_arrays(arrays, schema=self.schema))
+        self._cols = {name: [] for name in self.fieldnames}
+
+    def close(self):
+        self._flush()
+        self._writer.close()
+        os.replace(self.tmp_path, self.path)
+
+    def discard(self):
+        self._writer.close()
+        self.tmp_path.unlink(missing_ok=True)
 
 
-def export_aw_between_to_csv(start_utc, end_utc, out_dir: Path) -> str:
+EXPORT_FORMATS = {"csv": CsvEventWriter, "parquet": ParquetEventWriter}
+
+# Colunas extras quando repetições consecutivas são compactadas
+RUN_FIELDS = ["aw:repeat", "aw:run_end"]
+
+
+class RunLengthWriter:
     """
-    Exporta eventos AW em uma janela [start_utc, end_utc] para um CSV COMBINED.
-    Retorna o caminho do CSV.
-    Lança RuntimeError se não houver eventos.
+    Envolve um writer e junta eventos consecutivos do mesmo caso com o mesmo
+    concept:name numa linha só: 'time:timestamp' é o início da sequência,
+    'aw:run_end' o início do último evento, 'aw:repeat' a quantidade de
+    eventos, 'aw:duration' a soma das durações AW (s) e 'aw:end_timestamp'
+    o maior fim entre eles. O writer interno precisa ter sido criado com
+    EVENT_LOG_FIELDS + RUN_FIELDS.
     """
-    events = _collect_events_between(start_utc, end_utc)
-    if not events:
-        raise RuntimeError("Janela sem eventos (curta demais?).")
 
-    rows = []
-    case_id = "1"
+    def __init__(self, inner):
+        self.inner = inner
+        self.path = inner.path
+        self.events = 0
+        self._run = None
+
+    @property
+    def rows(self):
+        return self.inner.rows + (1 if self._run is not None else 0)
+
+    def write(self, row):
+        self.events += 1
+        run = self._run
+        if (run is not None and row["concept:name"] == run["concept:name"]
+                and row["case:concept:name"] == run["case:concept:name"]):
+            run["aw:repeat"] += 1
+            run["aw:run_end"] = row["time:timestamp"]
+            run["aw:duration"] += row["aw:duration"]
+            run["aw:end_timestamp"] = max(run["aw:end_timestamp"], row["aw:end_timestamp"])
+            return
+        self._flush()
+        self._run = {**row, "aw:repeat": 1, "aw:run_end": row["time:timestamp"]}
 
-    for ts, data, source_label, bucket_id in events:
-        if ts is None:
-            continue
-        if not isinstance(ts, datetime):
-            try:
-                ts = datetime.fromisoformat(str(ts))
-            except Exception:
-                continue
-        ts_utc = ts.astimezone(timezone.utc)
-
-        app = data.get("app") or data.get("exe") or ""
-        title = data.get("title") or data.get("window_title") or data.get("name") or ""
-        etype = data.get("etype") or data.get("event_type") or data.get("key_category") or source_label
-
-        parts = [p for p in [etype, app, title] if p]
-        activity = " | ".join(parts) if parts else "EVENTO"
-
-        rows.append(
-            {
-                "case:concept:name": case_id,
-                "concept:name": activity,
-                "time:timestamp": ts_utc.isoformat(),
-                "aw:bucket": bucket_id,
-                "aw:source": source_label,
-                "aw:app": app,
-                "aw:title": title,
-                "aw:etype": etype,
-            }
-        )
+    def _flush(self):
+        if self._run is not None:
+            self.inner.write(self._run)
+            self._run = None
+
+    def close(self):
+        self._flush()
+        self.inner.close()
+
+    def discard(self):
+        self._run = None
+        self.inner.discard()
 
-    if not rows:
-        raise RuntimeError("Sem linhas após o processamento dos eventos.")
 
-    # Nome com data + hora início/fim (local)
+class CaseSegmenter:
+    """
+    Divide o fluxo de eventos (em ordem de horário) em casos, numerados
+    "1", "2", ... Um novo caso começa quando qualquer regra ativa dispara:
+    - ``idle_gap`` (s): intervalo sem input maior que isso, medido só pelos
+      eventos de input/uia (o aw-watcher-window continua estendendo o evento
+      da janela em foco enquanto o usuário está ausente);
+    - ``home_app``: o foco volta para esta app vindo de outra;
+    - ``title_pattern`` (regex): entra numa janela cujo título casa o padrão;
+    - ``bucket`` (s): fatias fixas de tempo.
+    Sem regras, tudo fica no caso "1".
+    """
+
+    def __init__(self, idle_gap=None, home_app=None, title_pattern=None, bucket=None):
+        self.idle_gap = timedelta(seconds=idle_gap) if idle_gap else None
+        self.home_app = home_app.lower() if home_app else None
+        self.title_re = re.compile(title_pattern, re.IGNORECASE) if title_pattern else None
+        self.bucket = bucket or None
+        self.cases = 0
+        self._last_end = None
+        self._last_app = None
+        self._last_match = False
+        self._last_bucket = None
+
+    def case_for(self, row, duration=0.0) -> str:
+        ts = row["time:timestamp"]
+        app = (row.get("aw:app") or "").lower()
+        title = row.get("aw:title") or ""
+        split = self.cases == 0
+
+        source = row.get("aw:source")
+        if self.idle_gap is not None and self._last_end is not None and ts - self._last_end > self.idle_gap:
+            split = True
+        if self.home_app and app:
+            if app == self.home_app and self._last_app and self._last_app != self.home_app:
+                split = True
+            self._last_app = app
+        if self.title_re is not None and title:
+            match = bool(self.title_re.search(title))
+            if match and not self._last_match:
+                split = True
+            self._last_match = match
+        if self.bucket:
+            idx = int(ts.timestamp() // self.bucket)
+            if idx != self._last_bucket:
+                split = True
+            self._last_bucket = idx
+
+        if source != "window":
+            end = ts + timedelta(seconds=duration)
+            if self._last_end is None or end > self._last_end:
+                self._last_end = end
+        if split:
+            self.cases += 1
+        return str(self.cases)
+
+
+def _log_cardinality(normalizer, log):
+    if normalizer is not None:
+        raw, norm = normalizer.cardinality()
+        log(f"Atividades distintas: {raw} → {norm} após normalização dos rótulos")
+
+
+def _export_filename(start_utc, end_utc, fmt="csv") -> str:
+    """Nome com data + hora início/fim (local)."""
     start_local = start_utc.astimezone()
     end_local = end_utc.astimezone()
     date_str = start_local.strftime("%d%m%Y")
     start_str = start_local.strftime("%H-%M")
     end_str = end_local.strftime("%H-%M")
-    fname = f"event_log_COMBINED_{date_str}_{start_str}_{end_str}.csv"
-    out_path = out_dir / fname
+    return f"event_log_COMBINED_{date_str}_{start_str}_{end_str}.{fmt}"
 
-    fieldnames = list(rows[0].keys())
-    with out_path.open("w", newline="", encoding="utf-8") as f:
-        writer = csv.DictWriter(f, fieldnames=fieldnames)
-        writer.writeheader()
-        writer.writerows(rows)
 
-    return str(out_path)
+def export_aw_first_nonempty(windows, out_dir: Path, log=None, fmt="csv", use_query=False, apps=None,
+                             case_rules=None, collapse_runs=False):
+    """
+    Exporta a primeira janela não vazia de ``windows`` [(rótulo, início, fim), ...]
+    com uma única leitura do aw-server: a união das janelas é lida uma vez e
+    cada evento vai para o arquivo temporário de toda janela que ele toca
+    (começa até o fim dela e termina depois do início). No final fica só o
+    arquivo da primeira janela (na ordem dada) com linhas; os outros são apagados.
+    ``use_query``/``apps``: leitura pela API de query (ver _iter_events_between).
+    ``case_rules``: regras do CaseSegmenter para 'case:concept:name'
+    (cada janela numera seus casos a partir de "1").
+    ``collapse_runs``: repetições consecutivas viram uma linha (RunLengthWriter).
+    Retorna (rótulo, caminho). Lança RuntimeError se todas estiverem vazias.
+    """
+    log = log or logger.info
+    case_id = "1"
+    case_rules = case_rules or {}
+    normalizer = load_label_normalizer()
+    union_start = min(s for _, s, _ in windows)
+    union_end = max(e for _, _, e in windows)
+
+    writers = []
+    for i, (label, s, e) in enumerate(windows):
+        final = out_dir / _export_filename(s, e, fmt)
+        # caminho provisório por janela (duas janelas podem gerar o mesmo nome)
+        tmp = final.with_name(f"{final.name}.w{i}")
+        if collapse_runs:
+            writer = RunLengthWriter(EXPORT_FORMATS[fmt](tmp, EVENT_LOG_FIELDS + RUN_FIELDS))
+        else:
+            writer = EXPORT_FORMATS[fmt](tmp)
+        writers.append((label, s, e, final, writer, CaseSegmenter(**case_rules)))
+
+    seen = 0
+    try:
+        for event in _iter_events_between(union_start, union_end, log=log, use_query=use_query, apps=apps):
+            seen += 1
+            row = _event_to_row(event, case_id, normalizer)
+            if row is None:
+                continue
+            ts = row["time:timestamp"]
+            end_ts = ts + timedelta(seconds=event[4])
+            for _, s, e, _, writer, segmenter in writers:
+                if ts <= e and (ts >= s or end_ts > s):
+                    writer.write({**row, "case:concept:name": segmenter.case_for(row, event[4])})
+    except BaseException:
+        for _, _, _, _, writer, _ in writers:
+            writer.discard()
+        raise
+
+    _log_cardinality(normalizer, log)
+    chosen = None
+    for label, s, e, final, writer, segmenter in writers:
+        if collapse_runs:
+            log(f"Janela '{label}': {writer.events} eventos → {writer.rows} linhas "
+                f"em {segmenter.cases} caso(s)")
+        else:
+            log(f"Janela '{label}': {writer.rows} eventos em {segmenter.cases} caso(s)")
+        if chosen is None and writer.rows:
+            writer.close()
+            os.replace(writer.path, final)
+            chosen = (label, str(final))
+        else:
+            writer.discard()
+
+    if chosen is None:
+        if not seen:
+            raise RuntimeError("Janela sem eventos (curta demais?).")
+        raise RuntimeError("Sem linhas após o processamento dos eventos.")
+    return chosen
+
+
+def export_aw_between_to_csv(start_utc, end_utc, out_dir: Path, log=None, fmt="csv", case_rules=None,
+                             collapse_runs=False) -> str:
+    """
+    Exporta eventos AW em uma janela [start_utc, end_utc] para um event log
+    COMBINED em CSV (padrão) ou Parquet (``fmt="parquet"``).
+    Os eventos são lidos em fatias e gravados linha a linha (memória limitada).
+    Retorna o caminho do arquivo.
+    Lança RuntimeError se não houver eventos.
+    """
+    _, path = export_aw_first_nonempty(
+        [("", start_utc, end_utc)], out_dir, log=log, fmt=fmt, case_rules=case_rules,
+        collapse_runs=collapse_runs,
+    )
+    return path
+
+
+class RollingCsvLog:
+    """
+    Log contínuo em CSV, só com append: um arquivo por dia (ou por hora,
+    com ``per_hour``), escolhido pelo horário local de cada linha.
+    Arquivos novos recebem cabeçalho.
+    """
+
+    def __init__(self, directory: Path, per_hour=False, fieldnames=EVENT_LOG_FIELDS):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.per_hour = per_hour
+        self.fieldnames = fieldnames
+        self.paths = []
+        self.rows = 0
+        self._key = None
+        self._f = None
+        self._writer = None
+
+    def _open(self, ts_local):
+        key = ts_local.strftime("%Y%m%d_%H" if self.per_hour else "%Y%m%d")
+        if key == self._key:
+            return
+        self._close_current()
+        path = self._segment_path(key)
+        new = not path.exists() or path.stat().st_size == 0
+        self._f = path.open("a", newline="", encoding="utf-8")
+        self._writer = csv.DictWriter(self._f, fieldnames=self.fieldnames)
+        if new:
+            self._writer.writeheader()
+        self._key = key
+        if path not in self.paths:
+            self.paths.append(path)
+
+    def _segment_path(self, key):
+        """Arquivo do segmento; se o existente tiver outras colunas, usa _2, _3, ..."""
+        header = ",".join(self.fieldnames)
+        n = 1
+        while True:
+            suffix = "" if n == 1 else f"_{n}"
+            path = self.directory / f"event_log_ROLLING_{key}{suffix}.csv"
+            if not path.exists():
+                return path
+            with path.open("r", encoding="utf-8") as f:
+                if f.readline().strip() in ("", header):
+                    return path
+            n += 1
+
+    def write(self, row):
+        self._open(row["time:timestamp"].astimezone())
+        self._writer.writerow(_csv_row(row))
+        self.rows += 1
+
+    def _close_current(self):
+        if self._f is not None:
+            self._f.close()
+        self._f = self._writer = self._key = None
+
+    def close(self):
+        self._close_current()
+
+
+def _load_checkpoint(path: Path) -> dict:
+    """
+    bucket_id -> estado da exportação incremental:
+    - "until": até onde o bucket já foi lido;
+    - "ids": id -> fim dos eventos já gravados que ainda podem ser relidos;
+    - "open": id -> início dos eventos que ainda estavam crescendo;
+    - "legacy": formato antigo, que só guardava o horário do último evento.
+    """
+    try:
+        raw = json.loads(Path(path).read_text(encoding="utf-8"))
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        logger.warning("Checkpoint de exportação ilegível (%s): %s", path, e)
+        return {}
+    checkpoint = {}
+    for bid, state in raw.get("buckets", {}).items():
+        if isinstance(state, str):
+            checkpoint[bid] = {"until": datetime.fromisoformat(state), "ids": {}, "open": {}, "legacy": True}
+            continue
+        checkpoint[bid] = {
+            "until": datetime.fromisoformat(state["until"]),
+            "ids": {eid: datetime.fromisoformat(ts) for eid, ts in state.get("ids", [])},
+            "open": {eid: datetime.fromisoformat(ts) for eid, ts in state.get("open", [])},
+        }
+    return checkpoint
+
+
+def _save_checkpoint(path: Path, checkpoint: dict):
+    path = Path(path)
+    tmp = path.with_name(path.name + ".tmp")
+    buckets = {
+        bid: {
+            "until": state["until"].isoformat(),
+            "ids": [[eid, ts.isoformat()] for eid, ts in state["ids"].items()],
+            "open": [[eid, ts.isoformat()] for eid, ts in state["open"].items()],
+        }
+        for bid, state in checkpoint.items()
+    }
+    tmp.write_text(json.dumps({"buckets": buckets}, indent=2), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def _checkpoint_start(state):
+    """Início da releitura de um bucket: a sobreposição e os eventos em aberto."""
+    if state.get("legacy"):
+        return state["until"]
+    return min([state["until"] - EXPORT_OVERLAP, *state["open"].values()])
+
+
+def export_aw_incremental(start_utc, end_utc, out_dir: Path = ROLLING_DIR, per_hour=False,
+                          checkpoint_path: Path = CHECKPOINT_PATH, log=None):
+    """
+    Acrescenta ao log contínuo só os eventos novos desde o último checkpoint.
+    Nada antes de ``start_utc`` (início da sessão) é exportado; sem sessão
+    (``start_utc=None``) parte do checkpoint mais antigo ou, sem checkpoint,
+    dos últimos 60 min.
+
+    Cada bucket é relido desde EXPORT_OVERLAP antes da última leitura, para
+    pegar eventos gravados com horário anterior, e os já gravados são
+    reconhecidos pelo id. Eventos que ainda chegam ao fim da leitura (a
+    janela em foco, que o aw-watcher-window continua estendendo) ficam em
+    aberto: não são gravados e a próxima exportação relê desde o início
+    deles; saem com a duração final quando param de crescer.
+
+    O checkpoint só é salvo depois que as linhas estão no disco. Falha ao
+    ler um bucket interrompe a exportação: ficam registrados só os eventos
+    já gravados e a leitura é refeita na próxima execução.
+    Não exige parar o watcher.
+    Retorna (linhas gravadas, lista de arquivos tocados).
+    """
+    log = log or logger.info
+    checkpoint = _load_checkpoint(checkpoint_path)
+    read_from = {bid: _checkpoint_start(state) for bid, state in checkpoint.items()}
+    if start_utc is None:
+        start_utc = min(read_from.values(), default=end_utc - timedelta(minutes=60))
+    since = {bid: max(start_utc, ts) for bid, ts in read_from.items() if ts < end_utc}
+    case_id = "1"
+    normalizer = load_label_normalizer()
+
+    unread = set(checkpoint) - set(since)
+    still_open = {}
+    complete = False
+    rolling = RollingCsvLog(out_dir, per_hour=per_hour)
+    try:
+        for event in _iter_events_between(start_utc, end_utc, log=log, bucket_start=since,
+                                          strict=True):
+            ts, bid, duration, event_id = event[0], event[3], event[4], event[5]
+            state = checkpoint.setdefault(bid, {"until": start_utc, "ids": {}, "open": {}})
+            if event_id is None or state.get("legacy"):
+                if ts is not None and ts <= state["until"]:
+                    continue  # sem id: só o que começa depois da última leitura
+            elif event_id in state["ids"]:
+                continue
+            end_ts = ts + timedelta(seconds=duration) if ts is not None else None
+            if event_id is not None and end_ts is not None and end_ts >= end_utc:
+                still_open.setdefault(bid, {})[event_id] = ts
+                continue
+            row = _event_to_row(event, case_id, normalizer)
+            if row is None:
+                continue
+            rolling.write(row)
+            if event_id is not None:
+                state["ids"][event_id] = end_ts
+            elif ts is not None:
+                state["until"] = max(state["until"], ts)
+        complete = True
+    finally:
+        rolling.close()
+        if complete:
+            for bid, state in checkpoint.items():
+                if bid in unread:
+                    continue
+                state["until"] = end_utc
+                state["open"] = still_open.get(bid, {})
+                state.pop("legacy", None)
+                # ids que a próxima releitura ainda pode devolver
+                floor = min([end_utc - EXPORT_OVERLAP, *state["open"].values()])
+                state["ids"] = {eid: end for eid, end in state["ids"].items() if end >= floor}
+        _save_checkpoint(checkpoint_path, checkpoint)
+    _log_cardinality(normalizer, log)
+    return rolling.rows, [str(p) for p in rolling.paths]
 
 
 # ---------------------------------------------------------------------
@@ -205,10 +1047,14 @@ class WorkbenchApp(tk.Tk):
 
         self.title("SENAI TASK MINING - Gravador e exportador")
         self._config_icon()
-        self.geometry("650x350")
+        self.geometry("720x510")
 
-        self.watcher_proc = None
+        self.watcher_procs = {}  # papel -> Popen
         self.session_start_utc = None
+        self._supervise_id = None
+        self._spawned_at = {}  # papel -> time.monotonic() do último início
+        self._failures = {}  # papel -> falhas seguidas
+        self._retry_at = {}  # papel -> time.monotonic() do próximo reinício
 
         self._build_gui()
 
@@ -250,10 +1096,78 @@ class WorkbenchApp(tk.Tk):
         )
         self.btn_stop_export.grid(row=0, column=1, padx=5)
 
+        self.btn_partial = ttk.Button(
+            btn_frame,
+            text="Exportar parcial",
+            command=self.on_partial_export,
+        )
+        self.btn_partial.grid(row=1, column=0, padx=5, pady=(5, 0))
+
+        self.hourly_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(
+            btn_frame,
+            text="Log contínuo por hora",
+            variable=self.hourly_var,
+        ).grid(row=1, column=1, padx=5, pady=(5, 0), sticky="w")
+
+        self.query_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(
+            btn_frame,
+            text="Filtrar no servidor (apps):",
+            variable=self.query_var,
+        ).grid(row=1, column=2, padx=5, pady=(5, 0), sticky="e")
+
+        self.apps_var = tk.StringVar(value="")
+        ttk.Entry(btn_frame, textvariable=self.apps_var, width=22).grid(
+            row=1, column=3, columnspan=2, pady=(5, 0), sticky="w"
+        )
+
+        self.split_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(
+            btn_frame,
+            text="Captura e envio em processos separados",
+            variable=self.split_var,
+        ).grid(row=0, column=2, padx=5)
+
+        ttk.Label(btn_frame, text="Formato:").grid(row=0, column=3, padx=(15, 2))
+        self.format_var = tk.StringVar(value="csv")
+        ttk.Combobox(
+            btn_frame,
+            textvariable=self.format_var,
+            values=list(EXPORT_FORMATS),
+            state="readonly",
+            width=8,
+        ).grid(row=0, column=4)
+
+        case_frame = ttk.LabelFrame(frm, text="Divisão em casos (vazio = regra desligada)")
+        case_frame.pack(fill="x", pady=5)
+        self.case_vars = {}
+        for col, (key, text, width) in enumerate([
+            ("idle_gap", "Inatividade (min):", 5),
+            ("home_app", "App inicial:", 14),
+            ("title_pattern", "Título (regex):", 14),
+            ("bucket", "Fatia fixa (min):", 5),
+        ]):
+            ttk.Label(case_frame, text=text).grid(row=0, column=2 * col, padx=(5, 2))
+            var = tk.StringVar(value="")
+            ttk.Entry(case_frame, textvariable=var, width=width).grid(row=0, column=2 * col + 1)
+            self.case_vars[key] = var
+
+        self.collapse_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(
+            case_frame,
+            text="Compactar repetições consecutivas (aw:repeat)",
+            variable=self.collapse_var,
+        ).grid(row=1, column=0, columnspan=8, padx=5, pady=(5, 0), sticky="w")
+
         info = (
             "• Ao clicar em 'Iniciar gravação', o aw_watcher_uia.py será iniciado.\n"
             "• Ao clicar em 'Parar e exportar sessão', o watcher será encerrado e\n"
-            "  um CSV COMBINED será gerado na pasta 'outputs'.\n\n"
+            "  um event log COMBINED (CSV ou Parquet) será gerado na pasta 'outputs'.\n"
+            "• 'Exportar parcial' acrescenta só os eventos novos ao log contínuo em\n"
+            "  'outputs/rolling' (por dia ou por hora), sem parar o watcher.\n"
+            "• 'Filtrar no servidor' usa a API de query do aw-server (só as apps\n"
+            "  listadas, separadas por vírgula; vazio = todas).\n\n"
             "Depois, abra o arquivo no 'SENAI TASK MINING - Análises' para gerar\n"
             "DFG, estatísticas e variantes."
         )
@@ -275,8 +1189,73 @@ class WorkbenchApp(tk.Tk):
         self.log_text.configure(state="disabled")
 
     # ----------------------------------------------------- Controle watcher
+    def _watcher_running(self):
+        return any(p.poll() is None for p in self.watcher_procs.values())
+
+    def _spawn_watcher(self, role):
+        _stop_file(role).unlink(missing_ok=True)
+        proc = subprocess.Popen(
+            _watcher_cmd(role),
+            cwd=str(AW_UIA_DIR),
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            creationflags=getattr(subprocess, "CREATE_NO_WINDOW", 0),
+        )
+        self.watcher_procs[role] = proc
+        self._spawned_at[role] = time.monotonic()
+        return proc
+
+    def _update_pids(self):
+        if not self.watcher_procs:
+            self.pid_var.set("PID: -")
+        elif list(self.watcher_procs) == ["all"]:
+            self.pid_var.set(f"PID: {self.watcher_procs['all'].pid}")
+        else:
+            pids = ", ".join(f"{role}={p.pid}" for role, p in self.watcher_procs.items())
+            self.pid_var.set(f"PID: {pids}")
+
+    def _supervise(self):
+        """Reinicia processos do watcher que morrerem durante a gravação."""
+        self._supervise_id = None
+        if not self.watcher_procs:
+            return
+        now = time.monotonic()
+        for role, proc in list(self.watcher_procs.items()):
+            code = proc.poll()
+            if code is None:
+                if now - self._spawned_at.get(role, now) >= WATCHER_STABLE_S:
+                    self._failures.pop(role, None)
+                continue
+            if role not in self._retry_at:
+                fails = self._failures.get(role, 0) + 1
+                self._failures[role] = fails
+                if fails > WATCHER_MAX_RESTARTS:
+                    self._retry_at[role] = float("inf")
+                    self._append_log(
+                        f"[ERRO] Processo do watcher '{role}' encerrou (código {code}) "
+                        f"{fails} vezes seguidas. Não será reiniciado."
+                    )
+                    self.status_var.set(f"Gravando (watcher '{role}' parado)")
+                    continue
+                delay = min(RESTART_BACKOFF_MAX, SUPERVISE_MS / 1000.0 * 2 ** (fails - 1))
+                self._retry_at[role] = now + delay
+                self._append_log(
+                    f"Processo do watcher '{role}' encerrou (código {code}). Reiniciando em {delay:.0f}s."
+                )
+                continue
+            if now < self._retry_at[role]:
+                continue
+            del self._retry_at[role]
+            try:
+                new = self._spawn_watcher(role)
+                self._append_log(f"Watcher '{role}' reiniciado. PID={new.pid}")
+            except Exception as e:
+                self._append_log(f"[ERRO] Falha ao reiniciar '{role}': {e}")
+        self._update_pids()
+        self._supervise_id = self.after(SUPERVISE_MS, self._supervise)
+
     def on_start(self):
-        if self.watcher_proc and self.watcher_proc.poll() is None:
+        if self._watcher_running():
             messagebox.showinfo("Já está rodando", "O gravador já está em execução.")
             return
 
@@ -287,45 +1266,69 @@ class WorkbenchApp(tk.Tk):
             )
             return
 
+        roles = WATCHER_ROLES_SPLIT if self.split_var.get() else WATCHER_ROLES_SINGLE
         try:
-            python_exe = sys.executable
             self.session_start_utc = datetime.now(timezone.utc)
+            self.watcher_procs = {}
+            self._failures = {}
+            self._retry_at = {}
+            for role in roles:
+                self._spawn_watcher(role)
 
-            self.watcher_proc = subprocess.Popen(
-                _watcher_cmd(),
-                cwd=str(AW_UIA_DIR),
-                stdout=subprocess.DEVNULL,
-                stderr=subprocess.DEVNULL,
-                creationflags=getattr(subprocess, "CREATE_NO_WINDOW", 0),
-            )
-
-            pid = self.watcher_proc.pid
             self.status_var.set("Gravando")
-            self.pid_var.set(f"PID: {pid}")
+            self._update_pids()
             self.btn_start.configure(state="disabled")
             self.btn_stop_export.configure(state="normal")
-            self._append_log(f"Watcher iniciado. PID={pid}")
+            pids = ", ".join(f"{role}={p.pid}" for role, p in self.watcher_procs.items())
+            self._append_log(f"Watcher iniciado. PID {pids}")
+            self._supervise_id = self.after(SUPERVISE_MS, self._supervise)
         except Exception as e:
+            self._stop_watchers()
             self._append_log(f"[ERRO] Falha ao iniciar watcher: {e}")
             messagebox.showerror("Erro", f"Falha ao iniciar watcher:\n{e}")
 
+    def _stop_watchers(self):
+        """
+        Para os processos pedindo a saída limpa pelo arquivo de parada (envio
+        do que está na fila, spool e rajadas pendentes) e esperando cada um
+        sair; terminate()/kill() só se não sair em WATCHER_STOP_TIMEOUT s.
+        A captura para primeiro, para o processo de envio drenar o ring.
+        """
+        if self._supervise_id is not None:
+            self.after_cancel(self._supervise_id)
+            self._supervise_id = None
+        procs, self.watcher_procs = self.watcher_procs, {}
+        self._retry_at = {}
+        for role in ("capture", "all", "publisher"):
+            proc = procs.get(role)
+            if proc is None or proc.poll() is not None:
+                continue
+            stop_file = _stop_file(role)
+            try:
+                stop_file.touch()
+                proc.wait(timeout=WATCHER_STOP_TIMEOUT)
+            except (OSError, subprocess.TimeoutExpired):
+                self._append_log(f"Watcher '{role}' não encerrou sozinho; forçando a parada.")
+                proc.terminate()
+                try:
+                    proc.wait(timeout=5)
+                except subprocess.TimeoutExpired:
+                    proc.kill()
+            finally:
+                stop_file.unlink(missing_ok=True)
+
     def on_stop_and_export(self):
-        if not self.watcher_proc:
+        if not self.watcher_procs:
             return
 
         # Para o watcher
         try:
-            if self.watcher_proc.poll() is None:
-                self.watcher_proc.terminate()
-                try:
-                    self.watcher_proc.wait(timeout=10)
-                except subprocess.TimeoutExpired:
-                    self.watcher_proc.kill()
+            self._stop_watchers()
             self._append_log("Watcher parado.")
         except Exception as e:
             self._append_log(f"[ERRO] Ao parar watcher: {e}")
         finally:
-            self.watcher_proc = None
+            self.watcher_procs = {}
             self.status_var.set("Parado")
             self.pid_var.set("PID: -")
             self.btn_start.configure(state="normal")
@@ -340,27 +1343,85 @@ class WorkbenchApp(tk.Tk):
 
         end_utc = datetime.now(timezone.utc)
 
+        try:
+            case_rules = self._case_rules()
+        except (ValueError, re.error) as e:
+            self._append_log(f"[ERRO] Regras de caso inválidas ({e}); exportando em um caso só.")
+            case_rules = {}
+
         # Exporta em thread para não travar a UI
         t = threading.Thread(
             target=self._export_session_thread,
-            args=(self.session_start_utc, end_utc),
+            args=(
+                self.session_start_utc, end_utc, self.format_var.get(), self._query_opts(),
+                case_rules, self.collapse_var.get(),
+            ),
             daemon=True,
         )
         t.start()
 
-    def _export_session_thread(self, start_utc, end_utc):
+    def on_partial_export(self):
+        self.btn_partial.configure(state="disabled")
+        end_utc = datetime.now(timezone.utc) - EXPORT_LAG
+        t = threading.Thread(
+            target=self._partial_export_thread,
+            args=(self.session_start_utc, end_utc, self.hourly_var.get()),
+            daemon=True,
+        )
+        t.start()
+
+    def _partial_export_thread(self, start_utc, end_utc, per_hour):
         try:
-            out_csv = self._export_with_fallback(start_utc, end_utc)
+            t0 = time.perf_counter()
+            rows, paths = export_aw_incremental(
+                start_utc, end_utc, per_hour=per_hour, log=self._append_log
+            )
+            self._append_log(
+                f"Exportação parcial: {rows} eventos novos em {time.perf_counter() - t0:.2f}s"
+                + (f" → {', '.join(paths)}" if paths else "")
+            )
+        except Exception as e:
+            self._append_log(f"[ERRO] Exportação parcial: {e}")
+        finally:
+            self.after(0, lambda: self.btn_partial.configure(state="normal"))
+
+    def _case_rules(self):
+        """Regras do CaseSegmenter a partir dos campos da GUI (minutos → s)."""
+        raw = {key: var.get().strip() for key, var in self.case_vars.items()}
+        rules = {}
+        for key in ("idle_gap", "bucket"):
+            if raw[key]:
+                rules[key] = float(raw[key].replace(",", ".")) * 60
+        if raw["home_app"]:
+            rules["home_app"] = raw["home_app"]
+        if raw["title_pattern"]:
+            re.compile(raw["title_pattern"])
+            rules["title_pattern"] = raw["title_pattern"]
+        return rules
+
+    def _query_opts(self):
+        """Opções de leitura pela API de query (lidas na thread da GUI)."""
+        if not self.query_var.get():
+            return {}
+        apps = [a.strip() for a in self.apps_var.get().split(",") if a.strip()]
+        return {"use_query": True, "apps": apps or None}
+
+    def _export_session_thread(self, start_utc, end_utc, fmt="csv", query_opts=None, case_rules=None,
+                               collapse_runs=False):
+        try:
+            out_csv = self._export_with_fallback(start_utc, end_utc, fmt, query_opts, case_rules, collapse_runs)
             self._append_log(f"Event log exportado: {out_csv}")
             messagebox.showinfo("Sucesso", f"Event log exportado para:\n{out_csv}")
         except Exception as e:
             self._append_log(f"[ERRO] Exportar sessão: {e}")
             messagebox.showerror("Erro", f"Falha ao exportar sessão:\n{e}")
 
-    def _export_with_fallback(self, start_utc, end_utc) -> str:
+    def _export_with_fallback(self, start_utc, end_utc, fmt="csv", query_opts=None, case_rules=None,
+                              collapse_runs=False) -> str:
         """
         Tenta exportar em algumas janelas diferentes para reduzir o problema
         de "sem eventos" se o relógio estiver um pouco desalinhado.
+        Todas as janelas saem de uma única leitura do aw-server.
         """
         testes = [
             ("Sessão Start→Agora (janela solicitada)", start_utc, end_utc),
@@ -373,25 +1434,24 @@ class WorkbenchApp(tk.Tk):
             ("Fallback: últimos 60 min", end_utc - timedelta(minutes=60), end_utc),
         ]
 
-        last_err = None
+        if fmt == "parquet" and pq is None:
+            self._append_log("pyarrow não instalado; exportando em CSV.")
+            fmt = "csv"
+
         for label, s, e in testes:
-            self._append_log(
-                f"Tentando exportar: {label} | {s.isoformat()} → {e.isoformat()}"
+            self._append_log(f"Janela candidata: {label} | {s.isoformat()} → {e.isoformat()}")
+        try:
+            label, path = export_aw_first_nonempty(
+                testes, OUTPUT_DIR, log=self._append_log, fmt=fmt, case_rules=case_rules,
+                collapse_runs=collapse_runs, **(query_opts or {})
             )
-            try:
-                csv_path = export_aw_between_to_csv(s, e, OUTPUT_DIR)
-                return csv_path
-            except RuntimeError as re:
-                self._append_log("Sem eventos nessa janela.")
-                last_err = re
-            except Exception as e:
-                self._append_log(f"[ERRO] Janela '{label}': {e}")
-                last_err = e
-
-        raise RuntimeError(
-            "Não há eventos nas janelas testadas. "
-            "Faça algumas ações (ALT+TAB, digitação) por ~15s e tente de novo."
-        ) from last_err
+        except RuntimeError as re:
+            raise RuntimeError(
+                "Não há eventos nas janelas testadas. "
+                "Faça algumas ações (ALT+TAB, digitação) por ~15s e tente de novo."
+            ) from re
+        self._append_log(f"Exportado com a janela: {label}")
+        return path
 
 
 def main():